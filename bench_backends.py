@@ -0,0 +1,68 @@
+"""
+Benchmark of the MPI backend against the local (multiprocessing) backend.
+
+Runs solution.py end to end for every pattern with both backends on the same
+number of processes and reports the wall-clock time of each run (including
+process startup, which is what the local backend is meant to save). The
+outputs of both backends are also compared.
+
+Usage:
+    python3 bench_backends.py --text testcases/text_1.txt --vocab testcases/vocab_1.txt \
+        --stopwords testcases/stopwords_1.txt --repeat 3
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+# Process count per pattern (pattern #2 needs exactly 5)
+PATTERN_SIZES = {1: 5, 2: 5, 3: 5, 4: 5}
+
+
+def run_solution(command):
+    """Run one command; returns (wall-clock seconds, stdout)."""
+    start = time.perf_counter()
+    completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               text=True, check=True)
+    return time.perf_counter() - start, completed.stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MPI vs local backend benchmark')
+    parser.add_argument('--text', type=str, default='testcases/text_1.txt')
+    parser.add_argument('--vocab', type=str, default='testcases/vocab_1.txt')
+    parser.add_argument('--stopwords', type=str, default='testcases/stopwords_1.txt')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per configuration (best is kept)')
+    parser.add_argument('--mpiexec', type=str, default='mpiexec',
+                        help='mpiexec command, e.g. "mpiexec --oversubscribe"')
+    args = parser.parse_args()
+
+    inputs = ['--text', args.text, '--vocab', args.vocab, '--stopwords', args.stopwords]
+    mismatches = 0
+    print(f"{'pattern':>7} {'-n':>3} {'mpi (s)':>9} {'local (s)':>10}")
+    for pattern, size in PATTERN_SIZES.items():
+        common = ['solution.py'] + inputs + ['--pattern', str(pattern)]
+        commands = {
+            'mpi': args.mpiexec.split() + ['-n', str(size), sys.executable] + common,
+            'local': [sys.executable] + common + ['--backend', 'local', '--np', str(size)],
+        }
+        best = {}
+        outputs = {}
+        for backend, command in commands.items():
+            times = []
+            for _ in range(args.repeat):
+                elapsed, outputs[backend] = run_solution(command)
+                times.append(elapsed)
+            best[backend] = min(times)
+        if outputs['mpi'] != outputs['local']:
+            mismatches += 1
+        print(f"{pattern:>7} {size:>3} {best['mpi']:9.3f} {best['local']:10.3f}"
+              + ("" if outputs['mpi'] == outputs['local'] else "  OUTPUT DIFFERS"))
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""
+Microbenchmark suite for the NLP operations of solution.py.
+
+Times the real lowercase_text, remove_punctuation, remove_stopwords,
+compute_term_frequency and compute_document_frequency over synthetic corpora
+of several sizes, vocabulary sizes and stopword-list sizes. For each case it
+reports ns/token and the peak memory allocated per token (via tracemalloc).
+
+Results can be stored as a baseline and later checked against it; the check
+fails (exit code 1) if any case got slower than the baseline by more than the
+tolerance factor. Timings are compared relative to a fixed calibration loop
+that is timed in the same run, so a uniformly slower (or busier) machine
+does not count as a regression.
+
+Usage:
+    python3 bench_operations.py                    # Print the results
+    python3 bench_operations.py --save-baseline    # Store them in bench_baseline.json
+    python3 bench_operations.py --check            # Compare against bench_baseline.json
+"""
+
+import argparse
+import json
+import random
+import string
+import sys
+import time
+import tracemalloc
+
+from solution import (lowercase_text, remove_punctuation, remove_stopwords,
+                      compute_term_frequency, compute_document_frequency)
+
+DEFAULT_BASELINE = 'bench_baseline.json'
+
+CORPUS_SIZES = (1000, 10000)      # Sentences
+VOCABULARY_SIZES = (10, 1000)     # Words
+STOPWORD_SIZES = (10, 300)        # Words
+QUICK_CORPUS_SIZES = (1000,)
+
+WORDS_PER_SENTENCE = 12
+WORD_POOL_SIZE = 5000
+SEED = 300
+
+
+def make_word_pool(rng):
+    """Generate a pool of distinct lowercase pseudo-words."""
+    pool = set()
+    while len(pool) < WORD_POOL_SIZE:
+        pool.add(''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 10))))
+    return sorted(pool)
+
+
+def make_corpus(rng, pool, num_sentences):
+    """Generate raw sentences with capitalized words and punctuation, like the testcases."""
+    sentences = []
+    for _ in range(num_sentences):
+        words = []
+        for _ in range(WORDS_PER_SENTENCE):
+            word = rng.choice(pool)
+            if rng.random() < 0.1:
+                word = word.capitalize()
+            if rng.random() < 0.1:
+                word += rng.choice(',.;:!?')
+            words.append(word)
+        sentences.append(' '.join(words))
+    return sentences
+
+
+def calibration_loop():
+    """Fixed pure-Python workload used to normalize timings across machines and runs."""
+    counts = {}
+    for i in range(200000):
+        key = i & 1023
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def measure(operation, num_tokens, repeat):
+    """
+    Measure one operation.
+
+    Returns:
+        Tuple (best ns/token over `repeat` runs, peak bytes allocated per token)
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        operation()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    operation()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best * 1e9 / num_tokens, peak / num_tokens
+
+
+def build_cases(corpus_sizes):
+    """Yield (case name, operation, token count) for the whole parameter grid."""
+    rng = random.Random(SEED)
+    pool = make_word_pool(rng)
+
+    for num_sentences in corpus_sizes:
+        raw = make_corpus(rng, pool, num_sentences)
+        lowered = lowercase_text(raw)
+        cleaned = remove_punctuation(lowered)
+        num_tokens = num_sentences * WORDS_PER_SENTENCE
+
+        yield (f"lowercase_text/sentences={num_sentences}",
+               lambda raw=raw: lowercase_text(raw), num_tokens)
+        yield (f"remove_punctuation/sentences={num_sentences}",
+               lambda lowered=lowered: remove_punctuation(lowered), num_tokens)
+
+        for num_stopwords in STOPWORD_SIZES:
+            stopwords_set = set(rng.sample(pool, num_stopwords))
+            yield (f"remove_stopwords/sentences={num_sentences}/stopwords={num_stopwords}",
+                   lambda cleaned=cleaned, stopwords_set=stopwords_set:
+                   remove_stopwords(cleaned, stopwords_set), num_tokens)
+
+        for num_vocab in VOCABULARY_SIZES:
+            vocabulary = set(rng.sample(pool, num_vocab))
+            yield (f"compute_term_frequency/sentences={num_sentences}/vocab={num_vocab}",
+                   lambda cleaned=cleaned, vocabulary=vocabulary:
+                   compute_term_frequency(cleaned, vocabulary), num_tokens)
+            yield (f"compute_document_frequency/sentences={num_sentences}/vocab={num_vocab}",
+                   lambda cleaned=cleaned, vocabulary=vocabulary:
+                   compute_document_frequency(cleaned, vocabulary), num_tokens)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NLP operation microbenchmarks')
+    parser.add_argument('--baseline', type=str, default=DEFAULT_BASELINE,
+                        help='Baseline file (JSON)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store the results as the new baseline')
+    parser.add_argument('--check', action='store_true',
+                        help='Fail if a case is slower than the baseline by more than --tolerance')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='Allowed slowdown factor relative to the baseline (default: 1.5)')
+    parser.add_argument('--repeat', type=int, default=7, help='Timed runs per case (best is kept)')
+    parser.add_argument('--quick', action='store_true', help='Only use the smallest corpus size')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.check:
+        try:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            print(f"Error: baseline {args.baseline} not found, run with --save-baseline first")
+            sys.exit(2)
+
+    calibration_ns, _ = measure(calibration_loop, 1, args.repeat)
+    results = {'_calibration_ns': calibration_ns}
+    speed_factor = 1.0
+    if '_calibration_ns' in baseline:
+        speed_factor = calibration_ns / baseline['_calibration_ns']
+        print(f"Calibration loop: {speed_factor:.2f}x the baseline machine's time\n")
+
+    failures = []
+    print(f"{'case':<62} {'ns/token':>10} {'bytes/token':>12} {'baseline':>10}")
+    for name, operation, num_tokens in build_cases(QUICK_CORPUS_SIZES if args.quick
+                                                   else CORPUS_SIZES):
+        ns_per_token, bytes_per_token = measure(operation, num_tokens, args.repeat)
+        results[name] = {'ns_per_token': ns_per_token, 'bytes_per_token': bytes_per_token}
+
+        reference = baseline.get(name)
+        note = ''
+        if reference is not None:
+            ratio = ns_per_token / speed_factor / reference['ns_per_token']
+            note = f"{ratio:9.2f}x"
+            if ratio > args.tolerance:
+                failures.append(name)
+                note += '  SLOWER'
+        print(f"{name:<62} {ns_per_token:10.1f} {bytes_per_token:12.1f} {note:>10}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {args.baseline}")
+
+    if failures:
+        print(f"\n✗ {len(failures)} case(s) slower than {args.tolerance}x the baseline:")
+        for name in failures:
+            print(f"  {name}")
+        sys.exit(1)
+    if args.check:
+        print(f"\n✓ All cases within {args.tolerance}x of the baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Microbenchmark for the chunk transports of solution.py.
+
+Measures the throughput of one pipeline hop (send_chunk on one rank, recv_chunk
+on the next) for the pickled sentence-list transport and the packed buffer
+transport. A hop is timed as half of a ping-pong round trip between ranks 0 and 1.
+
+Usage:
+    mpiexec -n 2 python3 bench_transport.py --text testcases/text_1.txt --repeat 200
+"""
+
+import argparse
+import time
+from mpi4py import MPI
+
+from solution import TRANSPORTS, make_chunk, read_file_lines, recv_chunk, send_chunk
+
+
+def ping_pong(comm, rank, chunk, transport, repeat):
+    """Bounce `chunk` between ranks 0 and 1 `repeat` times; returns seconds per hop on rank 0."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        if rank == 0:
+            send_chunk(comm, chunk, 1, 1, transport)
+            chunk = recv_chunk(comm, 1, 1, transport)
+        else:
+            received = recv_chunk(comm, 0, 1, transport)
+            send_chunk(comm, received, 0, 1, transport)
+    return (time.perf_counter() - start) / (2 * repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chunk transport microbenchmark')
+    parser.add_argument('--text', type=str, default='testcases/text_1.txt',
+                        help='Text file used as chunk contents')
+    parser.add_argument('--copies', type=int, default=100,
+                        help='How many times the text is replicated into one chunk')
+    parser.add_argument('--repeat', type=int, default=200, help='Round trips per transport')
+    args = parser.parse_args()
+
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    if comm.Get_size() != 2:
+        if rank == 0:
+            print("Error: the transport benchmark requires exactly 2 processes")
+        return
+
+    sentences = read_file_lines(args.text) * args.copies
+    payload_bytes = sum(len(sentence.encode('utf-8')) for sentence in sentences)
+
+    if rank == 0:
+        print(f"Chunk: {len(sentences)} sentences, {payload_bytes} UTF-8 bytes")
+
+    for transport in TRANSPORTS:
+        chunk = make_chunk(sentences, transport) if rank == 0 else None
+        ping_pong(comm, rank, chunk, transport, 5)  # Warm-up
+        seconds_per_hop = ping_pong(comm, rank, chunk, transport, args.repeat)
+        if rank == 0:
+            throughput = payload_bytes / seconds_per_hop / 1e6
+            print(f"{transport:>6}: {seconds_per_hop * 1e6:10.1f} us/hop  {throughput:10.1f} MB/s")
+
+
+if __name__ == '__main__':
+    main()
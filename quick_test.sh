@@ -24,6 +24,12 @@ echo "Testing Pattern #4 (3 processes)"
 echo "=========================================="
 mpiexec -n 3 python3 solution.py --text testcases/small_text.txt --vocab testcases/small_vocab.txt --stopwords testcases/small_stopwords.txt --pattern 4
 
+echo ""
+echo "=========================================="
+echo "Checking operation timings against bench_baseline.json"
+echo "=========================================="
+python3 bench_operations.py --check --quick
+
 echo ""
 echo "=========================================="
 echo "All tests completed!"
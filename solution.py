@@ -13,19 +13,48 @@ This program implements four MPI communication patterns for parallel NLP process
 """
 
 import argparse
+import contextlib
+import heapq
+import io
+import json
+import multiprocessing
+import os
+import select
 import string
-from mpi4py import MPI
+import sys
+import time
+from array import array
+from collections import Counter, OrderedDict, deque
+
+try:
+    import mpi4py
+    # MPI is initialized in main() only when the MPI backend is used
+    mpi4py.rc.initialize = False
+    from mpi4py import MPI
+except ImportError:  # Only the local backend is available
+    MPI = None
 
 # Note: This implementation uses ONLY the following MPI functions as required:
 # - comm.Get_rank()  → MPI_Comm_rank
 # - comm.Get_size()  → MPI_Comm_size
 # - comm.send()      → MPI_Send (point-to-point blocking send)
 # - comm.recv()      → MPI_Recv (point-to-point blocking receive)
+# - comm.Send()      → MPI_Send (buffer-based variant, used by the packed chunk transport)
+# - comm.Recv()      → MPI_Recv (buffer-based variant, used by the packed chunk transport)
 # 
 # Prohibited operations (NOT used):
 # - No collective operations (bcast, scatter, gather, reduce, allreduce, etc.)
 # - No non-blocking operations (isend, irecv, wait, etc.)
 
+# Normalization tables. Most input is pure ASCII; such text is lowercased and
+# stripped of punctuation at the byte level, where ASCII_LOWER_TABLE (one
+# 256-entry table) together with the deletion of PUNCTUATION_BYTES does both
+# steps in a single bytes.translate() call. Non-ASCII text uses the str path.
+PUNCTUATION_BYTES = string.punctuation.encode('ascii')
+ASCII_LOWER_TABLE = bytes.maketrans(string.ascii_uppercase.encode('ascii'),
+                                    string.ascii_lowercase.encode('ascii'))
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
 
 def read_file_lines(filepath):
     """
@@ -41,6 +70,28 @@ def read_file_lines(filepath):
         return [line.strip() for line in f if line.strip()]
 
 
+def ascii_translate(sentences, table, delete=b''):
+    """
+    Apply bytes.translate() to a whole list of ASCII sentences at once.
+    
+    The sentences are joined with '\n' so that one translate call covers the
+    whole chunk, then split again.
+    
+    Args:
+        sentences: List of sentences (strings)
+        table: 256-entry translation table (or None)
+        delete: Bytes to delete
+        
+    Returns:
+        List of translated sentences, or None if the chunk is not pure ASCII
+        (or a sentence itself contains '\n') and the str path must be used
+    """
+    joined = '\n'.join(sentences)
+    if not joined.isascii() or joined.count('\n') != len(sentences) - 1:
+        return None
+    return joined.encode('ascii').translate(table, delete).decode('ascii').split('\n')
+
+
 def lowercase_text(sentences):
     """
     Convert all characters in each sentence to lowercase.
@@ -51,6 +102,8 @@ def lowercase_text(sentences):
     Returns:
         List of lowercase sentences
     """
+    # str.lower() is already fast on ASCII strings; the byte-level table only
+    # pays off when it is combined with punctuation removal (normalize_text)
     return [sentence.lower() for sentence in sentences]
 
 
@@ -64,14 +117,35 @@ def remove_punctuation(sentences):
     Returns:
         List of sentences with punctuation removed
     """
+    # string.punctuation is pure ASCII, so the byte-level path is exact for ASCII chunks
+    result = ascii_translate(sentences, None, PUNCTUATION_BYTES)
+    if result is not None:
+        return result
+    
     result = []
     for sentence in sentences:
         # Remove all punctuation characters
-        cleaned = sentence.translate(str.maketrans('', '', string.punctuation))
+        cleaned = sentence.translate(PUNCTUATION_TABLE)
         result.append(cleaned)
     return result
 
 
+def normalize_text(sentences):
+    """
+    Lowercase and remove punctuation (same result as remove_punctuation(lowercase_text(...))).
+    
+    Args:
+        sentences: List of sentences (strings)
+        
+    Returns:
+        List of lowercase sentences with punctuation removed
+    """
+    result = ascii_translate(sentences, ASCII_LOWER_TABLE, PUNCTUATION_BYTES)
+    if result is not None:
+        return result
+    return remove_punctuation(lowercase_text(sentences))
+
+
 def remove_stopwords(sentences, stopwords_set):
     """
     Remove stopwords from each sentence.
@@ -98,11 +172,14 @@ def compute_term_frequency(sentences, vocabulary):
     
     Args:
         sentences: List of preprocessed sentences (strings)
-        vocabulary: Set of vocabulary words
+        vocabulary: Set of vocabulary words, or a compiled PhraseAutomaton
         
     Returns:
         Dictionary mapping vocabulary words to their term frequencies
     """
+    if isinstance(vocabulary, PhraseAutomaton):
+        return phrase_term_frequency(sentences, vocabulary)
+    
     tf = {word: 0 for word in vocabulary}
     
     # Count occurrences of each vocabulary word across all sentences
@@ -121,11 +198,14 @@ def compute_document_frequency(sentences, vocabulary):
     
     Args:
         sentences: List of preprocessed sentences (strings)
-        vocabulary: Set of vocabulary words
+        vocabulary: Set of vocabulary words, or a compiled PhraseAutomaton
         
     Returns:
         Dictionary mapping vocabulary words to their document frequencies
     """
+    if isinstance(vocabulary, PhraseAutomaton):
+        return phrase_document_frequency(sentences, vocabulary)
+    
     df = {word: 0 for word in vocabulary}
     
     # For each sentence, track which vocabulary words appear in it
@@ -154,11 +234,8 @@ def preprocess_sentences(sentences, stopwords_set):
     Returns:
         List of preprocessed sentences
     """
-    # Step 1: Lowercase
-    lowercased = lowercase_text(sentences)
-    
-    # Step 2: Remove punctuation
-    no_punctuation = remove_punctuation(lowercased)
+    # Steps 1 and 2: Lowercase and remove punctuation (one pass for ASCII chunks)
+    no_punctuation = normalize_text(sentences)
     
     # Step 3: Remove stopwords
     preprocessed = remove_stopwords(no_punctuation, stopwords_set)
@@ -166,13 +243,732 @@ def preprocess_sentences(sentences, stopwords_set):
     return preprocessed
 
 
-def pattern1(comm, rank, size, sentences, vocabulary, stopwords_set):
+# ---------------------------------------------------------------------------
+# Phrase vocabulary
+#
+# Vocabulary entries may be multi-word phrases such as "machine learning".
+# Such a vocabulary is compiled once (on the manager) into an Aho-Corasick
+# automaton over token sequences and shipped to all workers. Matching a
+# sentence then costs one automaton step per token, independent of the
+# number of phrases. A compiled vocabulary can be used everywhere a
+# vocabulary set is expected: it iterates over and contains its entries,
+# and compute_term_frequency/compute_document_frequency dispatch on it.
+# ---------------------------------------------------------------------------
+
+class PhraseAutomaton:
+    """
+    Aho-Corasick automaton whose alphabet is the set of tokens.
+    
+    State 0 is the root. goto[state] maps a token to the next state,
+    fail[state] is the state of the longest proper suffix that is also a
+    prefix of some phrase, and output[state] lists the vocabulary entries
+    that end in that state (including those reached through fail links).
+    """
+    
+    def __init__(self, vocabulary):
+        self.entries = set(vocabulary)
+        self.goto = [{}]
+        output = [[]]
+        
+        # Build the trie of token sequences
+        for entry in self.entries:
+            state = 0
+            for token in entry.split():
+                next_state = self.goto[state].get(token)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][token] = next_state
+                    self.goto.append({})
+                    output.append([])
+                state = next_state
+            output[state].append(entry)
+        
+        # Compute fail links breadth-first and merge outputs along them
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and token not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(token, 0)
+                output[next_state].extend(output[self.fail[next_state]])
+        self.output = [tuple(entries) for entries in output]
+    
+    def __iter__(self):
+        return iter(self.entries)
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def __contains__(self, entry):
+        return entry in self.entries
+    
+    def matches(self, tokens):
+        """Yield every vocabulary entry occurrence in the token sequence (overlaps included)."""
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        state = 0
+        for token in tokens:
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+            yield from output[state]
+
+
+def compile_vocabulary(vocabulary):
+    """
+    Compile a vocabulary for counting.
+    
+    Args:
+        vocabulary: Set of vocabulary entries (words or multi-word phrases)
+        
+    Returns:
+        The set itself if all entries are single words, otherwise a PhraseAutomaton
+    """
+    if any(len(entry.split()) > 1 for entry in vocabulary):
+        return PhraseAutomaton(vocabulary)
+    return vocabulary
+
+
+def phrase_term_frequency(sentences, automaton):
+    """TF counting for a compiled phrase vocabulary."""
+    tf = {entry: 0 for entry in automaton}
+    for sentence in sentences:
+        for entry in automaton.matches(sentence.split()):
+            tf[entry] += 1
+    return tf
+
+
+def phrase_document_frequency(sentences, automaton):
+    """DF counting for a compiled phrase vocabulary."""
+    df = {entry: 0 for entry in automaton}
+    for sentence in sentences:
+        for entry in set(automaton.matches(sentence.split())):
+            df[entry] += 1
+    return df
+
+
+# ---------------------------------------------------------------------------
+# Duplicate-sentence elimination (--dedup)
+#
+# Repeated sentences are processed only once. Within a chunk, the distinct
+# sentences are processed and the results are mapped back to every copy
+# (TF contributions are scaled by the multiplicity of a sentence and DF
+# contributions are counted once per copy). Across chunks, each rank keeps a
+# bounded LRU cache of recent results: original sentence -> processed
+# sentence for the preprocessing stages, and preprocessed sentence -> tuple
+# of vocabulary IDs for TF/DF counting. Hit rates are reported on stderr.
+# ---------------------------------------------------------------------------
+
+DEDUP_CACHE_SIZE = 65536  # Entries per cache
+
+
+class SentenceCache:
+    """Bounded LRU cache of per-sentence results with reuse statistics."""
+    
+    def __init__(self, label, capacity=DEDUP_CACHE_SIZE):
+        self.label = label
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lookups = 0  # Sentences (including copies) that asked for a result
+        self.reused = 0   # ... that did not need to be computed
+        self.vocabulary = None
+        self.vocabulary_ids = None
+    
+    def get(self, sentence):
+        result = self.entries.get(sentence)
+        if result is not None:
+            self.entries.move_to_end(sentence)
+        return result
+    
+    def put(self, sentence, result):
+        self.entries[sentence] = result
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+    
+    def ids_for(self, vocabulary):
+        """Vocabulary entry -> ID mapping (rebuilt only if the vocabulary object changes)."""
+        if self.vocabulary is not vocabulary:
+            self.vocabulary = vocabulary
+            self.vocabulary_ids = {entry: i for i, entry in enumerate(sorted(vocabulary))}
+            self.entries.clear()
+        return self.vocabulary_ids
+    
+    def report(self, rank):
+        """Print the reuse statistics of this cache to stderr."""
+        rate = self.reused / self.lookups if self.lookups else 0.0
+        print(f"Dedup: rank {rank} {self.label}: {self.reused}/{self.lookups} sentences reused "
+              f"({rate:.1%})", file=sys.stderr, flush=True)
+
+
+def stage_cache(dedup, label):
+    """SentenceCache for one processing stage, or None if deduplication is off."""
+    return SentenceCache(label) if dedup else None
+
+
+def report_caches(rank, *caches):
+    """Report the statistics of every cache that was used (packed chunks bypass the caches)."""
+    for cache in caches:
+        if cache is not None and cache.lookups:
+            cache.report(rank)
+
+
+def cached_apply(sentences, operation, cache):
+    """
+    Apply a list operation, computing each distinct uncached sentence only once.
+    
+    Args:
+        sentences: List of sentences (strings)
+        operation: Function mapping a list of sentences to a list of results
+        cache: SentenceCache holding results of earlier chunks
+        
+    Returns:
+        List of results, one per input sentence
+    """
+    results = {}
+    missing = []
+    for sentence in dict.fromkeys(sentences):
+        result = cache.get(sentence)
+        if result is None:
+            missing.append(sentence)
+        else:
+            results[sentence] = result
+    for sentence, result in zip(missing, operation(missing)):
+        results[sentence] = result
+        cache.put(sentence, result)
+    
+    cache.lookups += len(sentences)
+    cache.reused += len(sentences) - len(missing)
+    return [results[sentence] for sentence in sentences]
+
+
+def vocabulary_ids(sentence, vocabulary, ids):
+    """Tuple of the IDs of all vocabulary matches (with repetitions) in a preprocessed sentence."""
+    if isinstance(vocabulary, PhraseAutomaton):
+        return tuple(ids[entry] for entry in vocabulary.matches(sentence.split()))
+    return tuple(ids[word] for word in sentence.split() if word in ids)
+
+
+def deduplicated_frequencies(sentences, vocabulary, cache):
+    """
+    Compute TF and DF, counting each distinct sentence once and weighting it by its multiplicity.
+    
+    Args:
+        sentences: List of preprocessed sentences (strings)
+        vocabulary: Set of vocabulary words, or a compiled PhraseAutomaton
+        cache: SentenceCache mapping preprocessed sentences to vocabulary ID tuples
+        
+    Returns:
+        Tuple (TF dictionary, DF dictionary)
+    """
+    ids = cache.ids_for(vocabulary)
+    multiplicities = Counter(sentences)
+    id_tuples = cached_apply(list(multiplicities),
+                             lambda missing: [vocabulary_ids(sentence, vocabulary, ids)
+                                              for sentence in missing], cache)
+    # Copies within the chunk were also reused
+    cache.lookups += len(sentences) - len(multiplicities)
+    cache.reused += len(sentences) - len(multiplicities)
+    
+    tf = [0] * len(ids)
+    df = [0] * len(ids)
+    for matched, count in zip(id_tuples, multiplicities.values()):
+        for word_id in matched:
+            tf[word_id] += count
+        for word_id in set(matched):
+            df[word_id] += count
+    words = list(ids)
+    return dict(zip(words, tf)), dict(zip(words, df))
+
+
+# ---------------------------------------------------------------------------
+# N-gram counting (--ngrams N)
+#
+# Counts runs of N consecutive vocabulary words in the preprocessed (stopword
+# free) sentences. Every single-word vocabulary entry gets an ID (its index
+# in sorted order) and an n-gram is packed into one 64-bit integer of N
+# fixed-width ID fields, so the counts are int -> int hash tables instead of
+# dictionaries keyed by tuples or strings. Workers send their counts as two
+# sorted int64 arrays (keys, counts); the manager merges these sorted runs
+# into one sorted pair of arrays and decodes the keys back into words only
+# for printing.
+# ---------------------------------------------------------------------------
+
+NGRAM_KEY_BITS = 63  # Packed keys must fit a signed 64-bit integer
+
+# Names and titles of the n-gram statistics in a pattern's results
+NGRAM_TITLES = {'ngram_tf': 'N-gram Term Frequencies',
+                'ngram_df': 'N-gram Document Frequencies'}
+
+
+class NgramTable:
+    """Packing of n-grams of vocabulary words into 64-bit integer keys."""
+    
+    def __init__(self, vocabulary, n):
+        self.n = n
+        self.words = sorted(entry for entry in vocabulary if ' ' not in entry)
+        self.ids = {word: word_id for word_id, word in enumerate(self.words)}
+        self.bits = max(1, (len(self.words) - 1).bit_length())
+        if self.bits * n > NGRAM_KEY_BITS:
+            raise ValueError(f"{n}-grams of {len(self.words)} vocabulary words do not fit "
+                             f"into {NGRAM_KEY_BITS}-bit keys")
+        self.mask = (1 << (self.bits * n)) - 1
+    
+    def sentence_keys(self, tokens):
+        """Packed keys of all n-grams of vocabulary words in a list of tokens."""
+        ids = self.ids
+        bits = self.bits
+        mask = self.mask
+        n = self.n
+        keys = []
+        key = 0
+        run = 0  # Length of the current run of vocabulary words
+        for token in tokens:
+            word_id = ids.get(token)
+            if word_id is None:
+                run = 0
+                continue
+            # Shift the new ID in; the mask drops the field of the oldest word
+            key = ((key << bits) | word_id) & mask
+            run += 1
+            if run >= n:
+                keys.append(key)
+        return keys
+    
+    def decode(self, key):
+        """The n-gram (words separated by spaces) of a packed key."""
+        field = (1 << self.bits) - 1
+        words = [self.words[(key >> (self.bits * i)) & field] for i in range(self.n)]
+        return ' '.join(reversed(words))
+
+
+def validate_ngrams(n, vocabulary):
+    """Return an error message if n-grams cannot be counted, None otherwise."""
+    if n < 1:
+        return f"Error: --ngrams requires N >= 1, got {n}"
+    try:
+        NgramTable(vocabulary, n)
+    except ValueError as e:
+        return f"Error: {e}"
+    return None
+
+
+def count_ngrams(sentences, table, tf, df):
+    """
+    Add the n-gram TF and DF of preprocessed sentences to running counts.
+    
+    Args:
+        sentences: List of preprocessed sentences (strings)
+        table: NgramTable
+        tf: Counter of packed key -> occurrences (updated in place)
+        df: Counter of packed key -> sentences containing the n-gram (updated in place)
+    """
+    for sentence in sentences:
+        keys = table.sentence_keys(sentence.split())
+        if keys:
+            tf.update(keys)
+            df.update(set(keys))
+
+
+def sorted_counts(counts):
+    """Pack a Counter of n-gram keys into the sorted arrays (keys, counts) sent to the manager."""
+    keys = array('q', sorted(counts))
+    return keys, array('q', [counts[key] for key in keys])
+
+
+def merge_ngram_counts(runs):
+    """
+    Merge the sorted arrays (keys, counts) received from the workers.
+    
+    Args:
+        runs: List of (keys, counts) pairs of int64 arrays, each sorted by key
+    
+    Returns:
+        One sorted pair of arrays (keys, counts); the counts of equal keys are summed
+    """
+    keys = array('q')
+    counts = array('q')
+    for key, count in heapq.merge(*(zip(*run) for run in runs)):
+        if keys and keys[-1] == key:
+            counts[-1] += count
+        else:
+            keys.append(key)
+            counts.append(count)
+    return keys, counts
+
+
+def collect_ngram_counts(comm, sources, table):
+    """Receive the n-gram counts of `sources` (tag 5), merge them and decode the n-grams."""
+    tf_runs = []
+    df_runs = []
+    for source in sources:
+        worker_tf, worker_df = comm.recv(source=source, tag=5)
+        tf_runs.append(worker_tf)
+        df_runs.append(worker_df)
+    return decode_ngram_counts(table, merge_ngram_counts(tf_runs), merge_ngram_counts(df_runs))
+
+
+def decode_ngram_counts(table, tf, df):
+    """Statistics entries (keyed by the n-grams' words) of the merged (keys, counts) arrays."""
+    return {'ngram_tf': {table.decode(key): count for key, count in zip(*tf)},
+            'ngram_df': {table.decode(key): count for key, count in zip(*df)}}
+
+
+def pipeline_stages(ngrams):
+    """Stages (ranks) per linear pipeline; n-gram counting is appended as a fifth stage."""
+    return 5 if ngrams else 4
+
+
+# ---------------------------------------------------------------------------
+# Chunk transport
+#
+# With the "pickle" transport a chunk is a plain list of sentences sent with
+# comm.send(). With the "packed" transport a chunk is a PackedChunk: all
+# sentences of the chunk encoded as UTF-8 in ONE contiguous buffer, each one
+# terminated by b'\n', plus an int64 offsets array. It is sent with the
+# buffer-based comm.Send()/comm.Recv(), so nothing is pickled on the way and
+# the pipeline stages can transform the whole buffer at once instead of
+# allocating one string per sentence.
+# ---------------------------------------------------------------------------
+
+TRANSPORTS = ('pickle', 'packed')
+
+# Datatypes of the packed buffers (the local backend ignores them)
+MPI_INT64 = MPI.INT64_T if MPI is not None else None
+MPI_BYTE = MPI.BYTE if MPI is not None else None
+
+
+class PackedChunk:
+    """
+    A chunk of sentences packed into one contiguous UTF-8 buffer.
+    
+    Sentence i is data[offsets[i]:offsets[i + 1] - 1]; the byte at
+    offsets[i + 1] - 1 is its b'\\n' terminator. Stripped input lines never
+    contain b'\\n', so the terminators also let whole-buffer operations keep
+    the sentence boundaries intact.
+    """
+    
+    __slots__ = ('data', 'offsets')
+    
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+    
+    @classmethod
+    def from_sentences(cls, sentences):
+        """Pack a list of sentences (strings) into a PackedChunk."""
+        encoded = [sentence.encode('utf-8') for sentence in sentences]
+        offsets = array('q', [0])
+        position = 0
+        for sentence in encoded:
+            position += len(sentence) + 1
+            offsets.append(position)
+        encoded.append(b'')
+        return cls(b'\n'.join(encoded), offsets)
+    
+    @classmethod
+    def from_terminated(cls, data, count):
+        """Build a PackedChunk from a buffer of `count` b'\\n'-terminated sentences."""
+        offsets = array('q', [0])
+        find = data.find
+        position = 0
+        for _ in range(count):
+            position = find(b'\n', position) + 1
+            offsets.append(position)
+        return cls(data, offsets)
+    
+    def __len__(self):
+        return len(self.offsets) - 1
+    
+    def sentences(self):
+        """Decode the chunk back into a list of sentences (strings)."""
+        if not self.data:
+            return []
+        lines = self.data.decode('utf-8').split('\n')
+        lines.pop()  # Empty string after the last terminator
+        return lines
+
+
+def packed_lowercase(chunk):
+    """Lowercasing stage on a PackedChunk."""
+    if chunk.data.isascii():
+        # ASCII lowercasing never changes lengths, so the offsets stay valid
+        return PackedChunk(chunk.data.lower(), chunk.offsets)
+    lowered = chunk.data.decode('utf-8').lower().encode('utf-8')
+    return PackedChunk.from_terminated(lowered, len(chunk))
+
+
+def packed_remove_punctuation(chunk):
+    """Punctuation removal stage on a PackedChunk."""
+    # string.punctuation is pure ASCII and UTF-8 multi-byte sequences never
+    # contain ASCII bytes, so deleting at the byte level is exact for any text
+    cleaned = chunk.data.translate(None, PUNCTUATION_BYTES)
+    if len(cleaned) == len(chunk.data):
+        return PackedChunk(cleaned, chunk.offsets)
+    return PackedChunk.from_terminated(cleaned, len(chunk))
+
+
+def packed_normalize(chunk):
+    """Lowercasing and punctuation removal on a PackedChunk (one translate for ASCII)."""
+    if not chunk.data.isascii():
+        return packed_remove_punctuation(packed_lowercase(chunk))
+    cleaned = chunk.data.translate(ASCII_LOWER_TABLE, PUNCTUATION_BYTES)
+    if len(cleaned) == len(chunk.data):
+        return PackedChunk(cleaned, chunk.offsets)
+    return PackedChunk.from_terminated(cleaned, len(chunk))
+
+
+def packed_remove_stopwords(chunk, stopwords_set):
+    """Stopword removal stage on a PackedChunk."""
+    if not len(chunk):
+        return chunk
+    # Word lookups need hashable str (or bytes) objects, so this stage decodes
+    # the buffer once (straight from the received bytearray) and allocates one
+    # string per line and per word, like remove_stopwords() does
+    filtered = remove_stopwords(chunk.sentences(), stopwords_set)
+    filtered.append('')
+    return PackedChunk.from_terminated('\n'.join(filtered).encode('utf-8'), len(chunk))
+
+
+def make_chunk(sentences, transport):
+    """Wrap a list of sentences in the chunk representation of `transport`."""
+    if transport == 'packed':
+        return PackedChunk.from_sentences(sentences)
+    return sentences
+
+
+def chunk_sentences(chunk):
+    """Return the sentences of a chunk of either transport as a list of strings."""
+    if isinstance(chunk, PackedChunk):
+        return chunk.sentences()
+    return chunk
+
+
+def concat_chunks(first, second):
+    """Concatenate two chunks of the same transport."""
+    if isinstance(first, PackedChunk):
+        shift = first.offsets[-1]
+        offsets = array('q', first.offsets)
+        offsets.extend(offset + shift for offset in second.offsets[1:])
+        data = bytearray(first.data)
+        data += second.data
+        return PackedChunk(data, offsets)
+    return first + second
+
+
+def lowercase_chunk(chunk, cache=None):
+    """Lowercasing on a chunk of either transport (deduplicated if a cache is given)."""
+    if isinstance(chunk, PackedChunk):
+        return packed_lowercase(chunk)
+    if cache is not None:
+        return cached_apply(chunk, lowercase_text, cache)
+    return lowercase_text(chunk)
+
+
+def remove_punctuation_chunk(chunk, cache=None):
+    """Punctuation removal on a chunk of either transport (deduplicated if a cache is given)."""
+    if isinstance(chunk, PackedChunk):
+        return packed_remove_punctuation(chunk)
+    if cache is not None:
+        return cached_apply(chunk, remove_punctuation, cache)
+    return remove_punctuation(chunk)
+
+
+def remove_stopwords_chunk(chunk, stopwords_set, cache=None):
+    """Stopword removal on a chunk of either transport (deduplicated if a cache is given)."""
+    if isinstance(chunk, PackedChunk):
+        return packed_remove_stopwords(chunk, stopwords_set)
+    if cache is not None:
+        return cached_apply(chunk, lambda missing: remove_stopwords(missing, stopwords_set), cache)
+    return remove_stopwords(chunk, stopwords_set)
+
+
+def preprocess_chunk(chunk, stopwords_set, cache=None):
+    """Full preprocessing (same steps as preprocess_sentences) on a chunk of either transport."""
+    if isinstance(chunk, PackedChunk):
+        return packed_remove_stopwords(packed_normalize(chunk), stopwords_set)
+    if cache is not None:
+        return cached_apply(chunk, lambda missing: preprocess_sentences(missing, stopwords_set),
+                            cache)
+    return preprocess_sentences(chunk, stopwords_set)
+
+
+def term_frequency_chunk(chunk, vocabulary, cache=None):
+    """TF counting on a chunk of either transport (deduplicated if a cache is given)."""
+    if cache is not None:
+        return deduplicated_frequencies(chunk_sentences(chunk), vocabulary, cache)[0]
+    if isinstance(chunk, PackedChunk) and not isinstance(vocabulary, PhraseAutomaton):
+        # The b'\n' terminators are whitespace, so splitting the whole decoded
+        # buffer yields exactly the tokens of all sentences (phrases must not
+        # match across sentence boundaries, so they take the per-sentence path)
+        return compute_term_frequency([chunk.data.decode('utf-8')], vocabulary)
+    return compute_term_frequency(chunk_sentences(chunk), vocabulary)
+
+
+def document_frequency_chunk(chunk, vocabulary, cache=None):
+    """DF counting on a chunk of either transport (deduplicated if a cache is given)."""
+    if cache is not None:
+        return deduplicated_frequencies(chunk_sentences(chunk), vocabulary, cache)[1]
+    return compute_document_frequency(chunk_sentences(chunk), vocabulary)
+
+
+def ngram_counts_chunk(chunk, table):
+    """N-gram TF and DF of a preprocessed chunk of either transport, as sorted (keys, counts) arrays."""
+    tf = Counter()
+    df = Counter()
+    count_ngrams(chunk_sentences(chunk), table, tf, df)
+    return sorted_counts(tf), sorted_counts(df)
+
+
+def send_chunk(comm, chunk, dest, tag, transport):
+    """
+    Send a chunk (or None as the termination signal) to `dest`.
+    
+    The packed transport sends a two-entry int64 header (sentence count,
+    buffer size; count -1 means termination), then the offsets array and
+    the data buffer, all with the buffer-based comm.Send(). Messages between
+    the same pair of ranks with the same tag are non-overtaking, so the
+    receiver always sees the three parts in order.
+    """
+    if transport != 'packed':
+        comm.send(chunk, dest=dest, tag=tag)
+        return
+    if chunk is None:
+        comm.Send([array('q', [-1, 0]), MPI_INT64], dest=dest, tag=tag)
+        return
+    comm.Send([array('q', [len(chunk), len(chunk.data)]), MPI_INT64], dest=dest, tag=tag)
+    comm.Send([chunk.offsets, MPI_INT64], dest=dest, tag=tag)
+    comm.Send([chunk.data, MPI_BYTE], dest=dest, tag=tag)
+
+
+def recv_chunk(comm, source, tag, transport):
+    """Receive a chunk sent with send_chunk(); returns None for the termination signal."""
+    if transport != 'packed':
+        return comm.recv(source=source, tag=tag)
+    header = array('q', [0, 0])
+    comm.Recv([header, MPI_INT64], source=source, tag=tag)
+    count, num_bytes = header
+    if count < 0:
+        return None
+    offsets = array('q', [0]) * (count + 1)
+    comm.Recv([offsets, MPI_INT64], source=source, tag=tag)
+    data = bytearray(num_bytes)
+    comm.Recv([data, MPI_BYTE], source=source, tag=tag)
+    return PackedChunk(data, offsets)
+
+
+# ---------------------------------------------------------------------------
+# Pattern #4 task groups
+#
+# Pattern #4 splits its workers into groups of k consecutive ranks with one
+# member per task (k = 2 for the default tasks TF and DF, which gives the
+# original odd/even pairs). The members of a group pass the preprocessed
+# shards around a ring in k - 1 steps (send to the next member, receive
+# from the previous one), so every member ends up with the whole data of
+# its group and computes its own task on it. New statistics are added with
+# register_task().
+# ---------------------------------------------------------------------------
+
+DEFAULT_TASKS = ('tf', 'df')
+
+# Registered tasks: name -> (title used in the output, function(chunk, vocabulary, cache))
+TASKS = {}
+
+
+def register_task(name, title, function):
+    """Register a per-corpus statistic that a member of a Pattern #4 group can compute."""
+    TASKS[name] = (title, function)
+
+
+def sentence_length_chunk(chunk, vocabulary, cache=None):
+    """Histogram of sentence lengths (tokens after preprocessing) of a chunk of either transport."""
+    return dict(Counter(len(sentence.split()) for sentence in chunk_sentences(chunk)))
+
+
+register_task('tf', 'Term Frequencies', term_frequency_chunk)
+register_task('df', 'Document Frequencies', document_frequency_chunk)
+register_task('lengths', 'Sentence Lengths', sentence_length_chunk)
+
+
+def validate_tasks(tasks):
+    """Return an error message if the task list cannot be run, None otherwise."""
+    if not tasks:
+        return "Error: at least one task is required"
+    unknown = [name for name in tasks if name not in TASKS]
+    if unknown:
+        return f"Error: unknown task(s) {', '.join(unknown)} (registered: {', '.join(TASKS)})"
+    if len(set(tasks)) != len(tasks):
+        return "Error: every task may be listed only once"
+    return None
+
+
+def merge_counts(total, counts):
+    """Add the counts of one worker (dictionary key -> count) to the running total."""
+    for key, count in counts.items():
+        total[key] = total.get(key, 0) + count
+    return total
+
+
+def ring_exchange(comm, rank, group_ranks, chunk, transport):
+    """
+    Gather the chunks of all members of a group in k - 1 ring steps.
+    
+    In every step each member forwards the chunk it received last to the next
+    member and receives a new one from the previous member. Even members send
+    first and odd members receive first, so there is no deadlock even if a send
+    blocks until it is matched (the last and the first member of an odd-sized
+    group both send first, but member 1 always receives first).
+    
+    Args:
+        comm: Communicator
+        rank: Rank of this member
+        group_ranks: Ranks of all group members, in ring order
+        chunk: This member's chunk
+        transport: Chunk transport
+        
+    Returns:
+        List of the chunks of all group members (own chunk first)
+    """
+    group_size = len(group_ranks)
+    member = group_ranks.index(rank)
+    next_rank = group_ranks[(member + 1) % group_size]
+    previous_rank = group_ranks[(member - 1) % group_size]
+    
+    gathered = [chunk]
+    outgoing = chunk
+    for _ in range(group_size - 1):
+        if member % 2 == 0:
+            send_chunk(comm, outgoing, next_rank, 2, transport)
+            incoming = recv_chunk(comm, previous_rank, 2, transport)
+        else:
+            incoming = recv_chunk(comm, previous_rank, 2, transport)
+            send_chunk(comm, outgoing, next_rank, 2, transport)
+        gathered.append(incoming)
+        outgoing = incoming
+    return gathered
+
+
+# Chunks per pipeline in patterns #2 and #3 (and in the --pattern auto cost
+# model); can be adjusted between 5 and 20
+PIPELINE_CHUNK_DIVISOR = 10
+
+
+def pattern1(comm, rank, size, sentences, vocabulary, stopwords_set, transport='pickle',
+             dedup=False, ngrams=0):
     """
     Pattern #1: Parallel End-to-End Processing in Worker Processes
     
     The manager divides text into balanced chunks and distributes them to workers.
     Each worker performs preprocessing and TF counting, then returns results to manager.
+    With ngrams = N, workers also count the N-grams of vocabulary words.
+    The manager returns (tf, None, statistics); workers return None.
     """
+    table = NgramTable(vocabulary, ngrams) if ngrams else None
+    
     if rank == 0:  # Manager process
         num_workers = size - 1
         num_sentences = len(sentences)
@@ -190,10 +986,10 @@ def pattern1(comm, rank, size, sentences, vocabulary, stopwords_set):
                 chunk_size += 1
             
             end_idx = start_idx + chunk_size
-            chunk = sentences[start_idx:end_idx]
+            chunk = make_chunk(sentences[start_idx:end_idx], transport)
             
             # Send chunk to worker
-            comm.send(chunk, dest=worker_rank, tag=1)
+            send_chunk(comm, chunk, worker_rank, 1, transport)
             start_idx = end_idx
         
         # Collect TF results from all workers
@@ -204,111 +1000,134 @@ def pattern1(comm, rank, size, sentences, vocabulary, stopwords_set):
             for word in vocabulary:
                 aggregated_tf[word] += worker_tf[word]
         
-        # Print results
-        print("Pattern #1 Results - Term Frequencies:")
-        for word in sorted(vocabulary):
-            print(f"{word}: {aggregated_tf[word]}")
+        statistics = {}
+        if table is not None:
+            statistics = collect_ngram_counts(comm, range(1, size), table)
+        return aggregated_tf, None, statistics
     
     else:  # Worker process
         # Receive chunk from manager
-        chunk = comm.recv(source=0, tag=1)
+        chunk = recv_chunk(comm, 0, 1, transport)
+        preprocess_cache = stage_cache(dedup, 'preprocessing')
+        tf_cache = stage_cache(dedup, 'TF counting')
         
         # Preprocess chunk
-        preprocessed = preprocess_sentences(chunk, stopwords_set)
+        preprocessed = preprocess_chunk(chunk, stopwords_set, preprocess_cache)
         
         # Compute TF
-        tf = compute_term_frequency(preprocessed, vocabulary)
+        tf = term_frequency_chunk(preprocessed, vocabulary, tf_cache)
         
         # Send TF results back to manager
         comm.send(tf, dest=0, tag=2)
+        if table is not None:
+            comm.send(ngram_counts_chunk(preprocessed, table), dest=0, tag=5)
+        report_caches(rank, preprocess_cache, tf_cache)
 
 
-def pattern2(comm, rank, size, sentences, vocabulary, stopwords_set):
+def pattern2(comm, rank, size, sentences, vocabulary, stopwords_set, transport='pickle',
+             dedup=False, ngrams=0):
     """
     Pattern #2: Linear Pipeline
     
     Each worker performs exactly one stage of the NLP pipeline.
-    Data flows sequentially through the pipeline in chunks.
+    Data flows sequentially through the pipeline in chunks. With ngrams = N,
+    the TF stage forwards every chunk to a fifth stage (rank 5) counting N-grams.
+    The manager returns (tf, None, statistics); workers return None.
     """
+    table = NgramTable(vocabulary, ngrams) if ngrams else None
+    
     if rank == 0:  # Manager process
         num_sentences = len(sentences)
         
         # Determine chunk size (divide by value between 5 and 20)
-        chunk_divisor = 10  # Can be adjusted between 5-20
-        chunk_size = max(1, num_sentences // chunk_divisor)
+        chunk_size = max(1, num_sentences // PIPELINE_CHUNK_DIVISOR)
         
         # Send chunks to Worker 1
         chunk_idx = 0
         while chunk_idx < num_sentences:
-            chunk = sentences[chunk_idx:chunk_idx + chunk_size]
-            comm.send(chunk, dest=1, tag=1)
+            chunk = make_chunk(sentences[chunk_idx:chunk_idx + chunk_size], transport)
+            send_chunk(comm, chunk, 1, 1, transport)
             chunk_idx += chunk_size
         
         # Send termination signal to Worker 1
-        comm.send(None, dest=1, tag=1)
+        send_chunk(comm, None, 1, 1, transport)
         
         # Receive final TF results from Worker 4
         final_tf = comm.recv(source=4, tag=4)
         
-        # Print results
-        print("Pattern #2 Results - Term Frequencies:")
-        for word in sorted(vocabulary):
-            print(f"{word}: {final_tf[word]}")
+        statistics = {}
+        if table is not None:
+            statistics = collect_ngram_counts(comm, [5], table)
+        return final_tf, None, statistics
     
     elif rank == 1:  # Worker 1: Lowercasing
         # tf_accumulator = {word: 0 for word in vocabulary}             TODO: BABA BUNU CURSOR KOYMUŞ GEREKSİZ DİYE KALDIRDIM AMA GEREKEBİLİR BELKİ SEN DE Bİ BAKSAN İYİ OLUR
+        cache = stage_cache(dedup, 'lowercasing')
         
         while True:
-            chunk = comm.recv(source=0, tag=1)
+            chunk = recv_chunk(comm, 0, 1, transport)
             if chunk is None:  # Termination signal
-                comm.send(None, dest=2, tag=2)
+                send_chunk(comm, None, 2, 2, transport)
                 break
             
             # Apply lowercasing
-            processed = lowercase_text(chunk)
+            processed = lowercase_chunk(chunk, cache)
             
             # Send to Worker 2
-            comm.send(processed, dest=2, tag=2)
+            send_chunk(comm, processed, 2, 2, transport)
+        
+        report_caches(rank, cache)
         
         # Send accumulated TF to Worker 4 (will be empty, but needed for synchronization)
         # comm.send(tf_accumulator, dest=4, tag=4)      TODO: (üstteki kaldırdığımdan dolayı)       BABA BUNU CURSOR KOYMUŞ GEREKSİZ DİYE KALDIRDIM AMA GEREKEBİLİR BELKİ SEN DE Bİ BAKSAN İYİ OLUR
     
     elif rank == 2:  # Worker 2: Punctuation Removal
+        cache = stage_cache(dedup, 'punctuation removal')
+        
         while True:
-            chunk = comm.recv(source=1, tag=2)
+            chunk = recv_chunk(comm, 1, 2, transport)
             if chunk is None:  # Termination signal
-                comm.send(None, dest=3, tag=3)
+                send_chunk(comm, None, 3, 3, transport)
                 break
             
             # Apply punctuation removal
-            processed = remove_punctuation(chunk)
+            processed = remove_punctuation_chunk(chunk, cache)
             
             # Send to Worker 3
-            comm.send(processed, dest=3, tag=3)
+            send_chunk(comm, processed, 3, 3, transport)
+        
+        report_caches(rank, cache)
     
     elif rank == 3:  # Worker 3: Stopword Removal
+        cache = stage_cache(dedup, 'stopword removal')
+        
         while True:
-            chunk = comm.recv(source=2, tag=3)
+            chunk = recv_chunk(comm, 2, 3, transport)
             if chunk is None:  # Termination signal
-                comm.send(None, dest=4, tag=4)
+                send_chunk(comm, None, 4, 4, transport)
                 break
             
             # Apply stopword removal
-            processed = remove_stopwords(chunk, stopwords_set)
+            processed = remove_stopwords_chunk(chunk, stopwords_set, cache)
             
             # Send to Worker 4
-            comm.send(processed, dest=4, tag=4)
+            send_chunk(comm, processed, 4, 4, transport)
+        
+        report_caches(rank, cache)
     
     elif rank == 4:  # Worker 4: TF Counting
         tf_accumulator = {word: 0 for word in vocabulary}
+        cache = stage_cache(dedup, 'TF counting')
         
         while True:
-            chunk = comm.recv(source=3, tag=4)
+            chunk = recv_chunk(comm, 3, 4, transport)
+            if table is not None:  # Forward the chunk (or termination signal) to Worker 5
+                send_chunk(comm, chunk, 5, 5, transport)
             if chunk is None:  # Termination signal
                 break
             
             # Compute TF for this chunk
-            chunk_tf = compute_term_frequency(chunk, vocabulary)
+            chunk_tf = term_frequency_chunk(chunk, vocabulary, cache)
             
             # Accumulate TF results
             for word in vocabulary:
@@ -316,18 +1135,37 @@ def pattern2(comm, rank, size, sentences, vocabulary, stopwords_set):
         
         # Send final TF results to manager
         comm.send(tf_accumulator, dest=0, tag=4)
+        report_caches(rank, cache)
+    
+    elif rank == 5:  # Worker 5: N-gram Counting (only with ngrams)
+        ngram_tf = Counter()
+        ngram_df = Counter()
+        
+        while True:
+            chunk = recv_chunk(comm, 4, 5, transport)
+            if chunk is None:  # Termination signal
+                break
+            count_ngrams(chunk_sentences(chunk), table, ngram_tf, ngram_df)
+        
+        comm.send((sorted_counts(ngram_tf), sorted_counts(ngram_df)), dest=0, tag=5)
 
 
-def pattern3(comm, rank, size, sentences, vocabulary, stopwords_set):
+def pattern3(comm, rank, size, sentences, vocabulary, stopwords_set, transport='pickle',
+             dedup=False, ngrams=0):
     """
     Pattern #3: Parallel Pipelines (Multiple Independent Pipelines)
     
     Multiple independent linear pipelines operate simultaneously.
     Each pipeline has 4 stages (lowercasing, punctuation removal, stopword removal, TF counting).
+    With ngrams = N, every pipeline gets a fifth stage counting N-grams, so
+    pipelines are 5 ranks apart instead of 4.
+    The manager returns (tf, None, statistics); workers return None.
     """
-    num_pipelines = (size - 1) // 4  # Each pipeline needs 4 workers
-    pipeline_id = (rank - 1) // 4 if rank > 0 else -1
-    stage_in_pipeline = (rank - 1) % 4 if rank > 0 else -1
+    table = NgramTable(vocabulary, ngrams) if ngrams else None
+    stages = pipeline_stages(ngrams)
+    num_pipelines = (size - 1) // stages  # Each pipeline needs 4 (or 5) workers
+    pipeline_id = (rank - 1) // stages if rank > 0 else -1
+    stage_in_pipeline = (rank - 1) % stages if rank > 0 else -1
     
     if rank == 0:  # Manager process
         num_sentences = len(sentences)
@@ -337,8 +1175,7 @@ def pattern3(comm, rank, size, sentences, vocabulary, stopwords_set):
         remainder = num_sentences % num_pipelines
         
         # Determine chunk size for internal pipeline chunking (divide by value between 5-20)
-        chunk_divisor = 10
-        small_chunk_size = max(1, sentences_per_pipeline // chunk_divisor)
+        small_chunk_size = max(1, sentences_per_pipeline // PIPELINE_CHUNK_DIVISOR)
         
         # Distribute chunks to pipelines in a round-robin fashion
         # Each pipeline gets its share of sentences, then we send them in small chunks
@@ -357,90 +1194,124 @@ def pattern3(comm, rank, size, sentences, vocabulary, stopwords_set):
         # Send chunks to each pipeline's first worker
         # For each pipeline, send its sentences in small chunks
         for pipeline_idx in range(num_pipelines):
-            first_worker_rank = 1 + pipeline_idx * 4
+            first_worker_rank = 1 + pipeline_idx * stages
             pipeline_sentences = pipeline_chunks[pipeline_idx]
             
             # Send small chunks to this pipeline
             chunk_idx = 0
             while chunk_idx < len(pipeline_sentences):
                 small_chunk = pipeline_sentences[chunk_idx:chunk_idx + small_chunk_size]
-                comm.send(small_chunk, dest=first_worker_rank, tag=1)
+                send_chunk(comm, make_chunk(small_chunk, transport), first_worker_rank, 1, transport)
                 chunk_idx += small_chunk_size
             
             # Send termination signal to this pipeline
-            comm.send(None, dest=first_worker_rank, tag=1)
+            send_chunk(comm, None, first_worker_rank, 1, transport)
         
         # Collect TF results from last stage of each pipeline
         aggregated_tf = {word: 0 for word in vocabulary}
         for pipeline_idx in range(num_pipelines):
-            last_worker_rank = 4 + pipeline_idx * 4
-            pipeline_tf = comm.recv(source=last_worker_rank, tag=4)
+            tf_worker_rank = 4 + pipeline_idx * stages
+            pipeline_tf = comm.recv(source=tf_worker_rank, tag=4)
             # Aggregate results
             for word in vocabulary:
                 aggregated_tf[word] += pipeline_tf[word]
         
-        # Print results
-        print("Pattern #3 Results - Term Frequencies:")
-        for word in sorted(vocabulary):
-            print(f"{word}: {aggregated_tf[word]}")
+        statistics = {}
+        if table is not None:
+            statistics = collect_ngram_counts(
+                comm, [5 + pipeline_idx * stages for pipeline_idx in range(num_pipelines)], table)
+        return aggregated_tf, None, statistics
     
     elif stage_in_pipeline == 0:  # Stage 1: Lowercasing (ranks 1, 5, 9, ...)
+        cache = stage_cache(dedup, 'lowercasing')
+        
         # Receive chunks from manager and process them
         while True:
-            chunk = comm.recv(source=0, tag=1)
+            chunk = recv_chunk(comm, 0, 1, transport)
             if chunk is None:  # Termination signal
-                comm.send(None, dest=rank + 1, tag=2)
+                send_chunk(comm, None, rank + 1, 2, transport)
                 break
             
             # Apply lowercasing
-            processed = lowercase_text(chunk)
+            processed = lowercase_chunk(chunk, cache)
             
             # Send to next stage
-            comm.send(processed, dest=rank + 1, tag=2)
+            send_chunk(comm, processed, rank + 1, 2, transport)
+        
+        report_caches(rank, cache)
     
     elif stage_in_pipeline == 1:  # Stage 2: Punctuation Removal (ranks 2, 6, 10, ...)
+        cache = stage_cache(dedup, 'punctuation removal')
         while True:
-            chunk = comm.recv(source=rank - 1, tag=2)
+            chunk = recv_chunk(comm, rank - 1, 2, transport)
             if chunk is None:
-                comm.send(None, dest=rank + 1, tag=3)
+                send_chunk(comm, None, rank + 1, 3, transport)
                 break
             
-            processed = remove_punctuation(chunk)
-            comm.send(processed, dest=rank + 1, tag=3)
+            processed = remove_punctuation_chunk(chunk, cache)
+            send_chunk(comm, processed, rank + 1, 3, transport)
+        report_caches(rank, cache)
     
     elif stage_in_pipeline == 2:  # Stage 3: Stopword Removal (ranks 3, 7, 11, ...)
+        cache = stage_cache(dedup, 'stopword removal')
         while True:
-            chunk = comm.recv(source=rank - 1, tag=3)
+            chunk = recv_chunk(comm, rank - 1, 3, transport)
             if chunk is None:
-                comm.send(None, dest=rank + 1, tag=4)
+                send_chunk(comm, None, rank + 1, 4, transport)
                 break
             
-            processed = remove_stopwords(chunk, stopwords_set)
-            comm.send(processed, dest=rank + 1, tag=4)
+            processed = remove_stopwords_chunk(chunk, stopwords_set, cache)
+            send_chunk(comm, processed, rank + 1, 4, transport)
+        report_caches(rank, cache)
     
     elif stage_in_pipeline == 3:  # Stage 4: TF Counting (ranks 4, 8, 12, ...)
         tf_accumulator = {word: 0 for word in vocabulary}
+        cache = stage_cache(dedup, 'TF counting')
         
         while True:
-            chunk = comm.recv(source=rank - 1, tag=4)
+            chunk = recv_chunk(comm, rank - 1, 4, transport)
+            if table is not None:  # Forward the chunk (or termination signal) to stage 5
+                send_chunk(comm, chunk, rank + 1, 5, transport)
             if chunk is None:
                 break
             
-            chunk_tf = compute_term_frequency(chunk, vocabulary)
+            chunk_tf = term_frequency_chunk(chunk, vocabulary, cache)
             for word in vocabulary:
                 tf_accumulator[word] += chunk_tf[word]
         
         comm.send(tf_accumulator, dest=0, tag=4)
+        report_caches(rank, cache)
+    
+    elif stage_in_pipeline == 4:  # Stage 5: N-gram Counting (only with ngrams)
+        ngram_tf = Counter()
+        ngram_df = Counter()
+        
+        while True:
+            chunk = recv_chunk(comm, rank - 1, 5, transport)
+            if chunk is None:
+                break
+            count_ngrams(chunk_sentences(chunk), table, ngram_tf, ngram_df)
+        
+        comm.send((sorted_counts(ngram_tf), sorted_counts(ngram_df)), dest=0, tag=5)
 
 
-def pattern4(comm, rank, size, sentences, vocabulary, stopwords_set):
+def pattern4(comm, rank, size, sentences, vocabulary, stopwords_set, transport='pickle',
+             dedup=False, tasks=DEFAULT_TASKS, ngrams=0):
     """
     Pattern #4: End-to-End Processing with Task Parallelism
     
-    Workers perform preprocessing, then exchange data in pairs.
-    Even-ranked workers compute DF, odd-ranked workers compute TF.
+    Workers perform preprocessing, then exchange data within groups of
+    len(tasks) workers (pairs for the default tasks). Member j of every group
+    computes tasks[j] over the data of its group: with the default tasks,
+    odd-ranked workers compute TF and even-ranked workers compute DF. With
+    ngrams = N, the first member of every group also counts the N-grams.
+    The manager returns (tf, df, statistics), where tf or df is None if it is
+    not among the tasks and statistics holds the other tasks' (and n-gram)
+    counts; workers return None.
     """
     num_workers = size - 1
+    group_size = len(tasks)
+    table = NgramTable(vocabulary, ngrams) if ngrams else None
     
     if rank == 0:  # Manager process
         num_sentences = len(sentences)
@@ -457,142 +1328,1139 @@ def pattern4(comm, rank, size, sentences, vocabulary, stopwords_set):
                 chunk_size += 1
             
             end_idx = start_idx + chunk_size
-            chunk = sentences[start_idx:end_idx]
-            comm.send(chunk, dest=worker_rank, tag=1)
+            chunk = make_chunk(sentences[start_idx:end_idx], transport)
+            send_chunk(comm, chunk, worker_rank, 1, transport)
             start_idx = end_idx
         
-        # Collect TF and DF results
-        aggregated_tf = {word: 0 for word in vocabulary}
-        aggregated_df = {word: 0 for word in vocabulary}
-        
+        # Collect the task results (member j of every group computed tasks[j])
+        task_results = {name: {} for name in tasks}
         for worker_rank in range(1, size):
-            if worker_rank % 2 == 1:  # Odd rank: TF
-                worker_tf = comm.recv(source=worker_rank, tag=3)
-                for word in vocabulary:
-                    aggregated_tf[word] += worker_tf[word]
-            else:  # Even rank: DF
-                worker_df = comm.recv(source=worker_rank, tag=4)
-                for word in vocabulary:
-                    aggregated_df[word] += worker_df[word]
+            task = tasks[(worker_rank - 1) % group_size]
+            merge_counts(task_results[task], comm.recv(source=worker_rank, tag=3))
         
-        # Print results
-        print("Pattern #4 Results - Term Frequencies:")
-        for word in sorted(vocabulary):
-            print(f"{word}: {aggregated_tf[word]}")
-        print("Pattern #4 Results - Document Frequencies:")
-        for word in sorted(vocabulary):
-            print(f"{word}: {aggregated_df[word]}")
+        if table is not None:
+            task_results.update(collect_ngram_counts(comm, range(1, size, group_size), table))
+        return task_results.pop('tf', None), task_results.pop('df', None), task_results
     
     else:  # Worker process
         # Receive chunk from manager
-        chunk = comm.recv(source=0, tag=1)
+        chunk = recv_chunk(comm, 0, 1, transport)
+        
+        member = (rank - 1) % group_size
+        task = tasks[member]
+        preprocess_cache = stage_cache(dedup, 'preprocessing')
+        task_cache = stage_cache(dedup, f"task '{task}'")
         
         # Preprocess chunk
-        preprocessed = preprocess_sentences(chunk, stopwords_set)
-        
-        # Determine partner rank for data exchange
-        if rank % 2 == 1:  # Odd rank
-            partner_rank = rank + 1
-        else:  # Even rank
-            partner_rank = rank - 1
-        
-        # Data exchange: avoid deadlock by having even ranks send first, odd ranks receive first
-        if rank % 2 == 0:  # Even rank: send first
-            comm.send(preprocessed, dest=partner_rank, tag=2)
-            partner_data = comm.recv(source=partner_rank, tag=2)
-        else:  # Odd rank: receive first
-            partner_data = comm.recv(source=partner_rank, tag=2)
-            comm.send(preprocessed, dest=partner_rank, tag=2)
+        preprocessed = preprocess_chunk(chunk, stopwords_set, preprocess_cache)
+        
+        # Exchange data with the other members of the group
+        group_start = rank - member
+        group_ranks = list(range(group_start, group_start + group_size))
+        shards = ring_exchange(comm, rank, group_ranks, preprocessed, transport)
         
         # Combine data
-        combined_data = preprocessed + partner_data
+        combined_data = shards[0]
+        for shard in shards[1:]:
+            combined_data = concat_chunks(combined_data, shard)
         
-        # Split tasks: even ranks compute DF, odd ranks compute TF
-        if rank % 2 == 1:  # Odd rank: compute TF
-            tf = compute_term_frequency(combined_data, vocabulary)
-            comm.send(tf, dest=0, tag=3)
-        else:  # Even rank: compute DF
-            df = compute_document_frequency(combined_data, vocabulary)
-            comm.send(df, dest=0, tag=4)
+        # Compute this member's task over the group's data
+        result = TASKS[task][1](combined_data, vocabulary, task_cache)
+        comm.send(result, dest=0, tag=3)
+        if table is not None and member == 0:
+            comm.send(ngram_counts_chunk(combined_data, table), dest=0, tag=5)
+        report_caches(rank, preprocess_cache, task_cache)
 
 
-def main():
-    """Main function to parse arguments and execute the selected pattern."""
-    parser = argparse.ArgumentParser(description='MPI-Based Parallel NLP System')
-    parser.add_argument('--text', type=str, required=True, help='Path to input text file')
-    parser.add_argument('--vocab', type=str, required=True, help='Path to vocabulary file')
-    parser.add_argument('--stopwords', type=str, required=True, help='Path to stopwords file')
-    parser.add_argument('--pattern', type=int, choices=[1, 2, 3, 4], required=True,
-                        help='Processing pattern (1, 2, 3, or 4)')
+def validate_process_count(pattern, size, group_size=len(DEFAULT_TASKS), ngrams=0):
+    """
+    Check that `size` processes fit the given pattern.
     
-    args = parser.parse_args()
+    Args:
+        pattern: Pattern number (1-4)
+        size: Total number of MPI processes
+        group_size: Workers per Pattern #4 task group (number of tasks)
+        ngrams: N-gram size (0 if no n-grams are counted; adds a pipeline stage)
+        
+    Returns:
+        Error message (string), or None if the configuration is valid
+    """
+    stages = pipeline_stages(ngrams)
+    if pattern == 1 and size < 2:
+        return "Error: Pattern #1 requires at least 2 processes (1 manager + 1 worker)"
+    if pattern == 2 and size != 1 + stages:
+        return f"Error: Pattern #2 requires exactly {1 + stages} processes, got {size}"
+    if pattern == 3 and (size - 1) % stages != 0:
+        return f"Error: Pattern #3 requires size = 1 + {stages}i (i >= 1), got {size}"
+    if pattern == 4 and (size < 1 + group_size or (size - 1) % group_size != 0):
+        return f"Error: Pattern #4 requires size = 1 + {group_size}i (i >= 1), got {size}"
+    return None
+
+
+def run_pattern(pattern, comm, rank, size, sentences, vocabulary, stopwords_set, transport,
+                dedup=False, tasks=DEFAULT_TASKS, ngrams=0):
+    """Execute the selected pattern on every rank; returns (tf, df, statistics) on the manager."""
+    if pattern == 1:
+        return pattern1(comm, rank, size, sentences, vocabulary, stopwords_set, transport,
+                        dedup, ngrams)
+    elif pattern == 2:
+        return pattern2(comm, rank, size, sentences, vocabulary, stopwords_set, transport,
+                        dedup, ngrams)
+    elif pattern == 3:
+        return pattern3(comm, rank, size, sentences, vocabulary, stopwords_set, transport,
+                        dedup, ngrams)
+    elif pattern == 4:
+        return pattern4(comm, rank, size, sentences, vocabulary, stopwords_set, transport,
+                        dedup, tasks, ngrams)
+
+
+def print_results(pattern, tf, df, vocabulary, statistics=None):
+    """Print the TF, DF and other statistics (those that were computed) for the given vocabulary."""
+    if tf is not None:
+        print(f"Pattern #{pattern} Results - Term Frequencies:")
+        for word in sorted(vocabulary):
+            print(f"{word}: {tf[word]}")
+    if df is not None:
+        print(f"Pattern #{pattern} Results - Document Frequencies:")
+        for word in sorted(vocabulary):
+            print(f"{word}: {df[word]}")
+    for name, counts in (statistics or {}).items():
+        if name in NGRAM_TITLES:
+            title = NGRAM_TITLES[name]
+            # Only the n-grams made of words of this vocabulary (batch mode)
+            keys = [key for key in sorted(counts)
+                    if all(word in vocabulary for word in key.split())]
+        else:
+            title = TASKS[name][0]
+            keys = sorted(counts)
+        print(f"Pattern #{pattern} Results - {title}:")
+        for key in keys:
+            print(f"{key}: {counts[key]}")
+
+
+def merge_vocabularies(vocab_lists):
+    """
+    Merge several vocabularies into one combined vocabulary.
     
-    # Initialize MPI
-    comm = MPI.COMM_WORLD
+    TF and DF of a word do not depend on the other words of the vocabulary,
+    so counting once against the union and projecting the counts back onto
+    each vocabulary gives the same results as one run per vocabulary.
+    
+    Args:
+        vocab_lists: List of vocabularies (lists of words)
+        
+    Returns:
+        Tuple (combined vocabulary set, list of per-vocabulary sets)
+    """
+    vocabularies = [set(vocab_list) for vocab_list in vocab_lists]
+    return set().union(*vocabularies), vocabularies
+
+
+def print_batch_results(pattern, tf, df, vocab_names, vocabularies, statistics=None):
+    """Print the results of a combined run once per vocabulary."""
+    if len(vocabularies) == 1:
+        print_results(pattern, tf, df, vocabularies[0], statistics)
+        return
+    for name, vocabulary in zip(vocab_names, vocabularies):
+        print(f"Vocabulary: {name}")
+        print_results(pattern, tf, df, vocabulary, statistics)
+
+
+# ---------------------------------------------------------------------------
+# Automatic pattern selection (--pattern auto)
+#
+# Rank 0 samples the input, times every NLP operation on the sample and
+# feeds the per-sentence costs into a simple cost model of each pattern.
+# The operations and the message round trips use the selected transport, and
+# with --dedup the costs of the cached stages are scaled by the fraction of
+# distinct sentences. The model leaves out fixed costs (process wake-up, the
+# first messages of a run, result collection), so on small inputs the actual
+# run time is several times the prediction; it is meant to rank the patterns.
+# Patterns whose process layout does not match `size` exactly are run on the
+# largest valid number of ranks; the remaining ranks stay idle. Pattern #4
+# is not a candidate because it also computes DF and so prints a different
+# result than patterns #1-#3.
+# ---------------------------------------------------------------------------
+
+AUTO_PATTERNS = (1, 2, 3)
+AUTO_SAMPLE_SIZE = 256            # Sentences used to calibrate the cost model
+AUTO_MIN_BENCHMARK_SECONDS = 0.005  # Each operation is repeated at least this long
+AUTO_PINGS = 20                   # Round trips with rank 1 to calibrate message costs
+
+
+def available_cores():
+    """Number of CPU cores this process may run on (used to cap the modelled parallelism)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def time_operation(operation, sample_len):
+    """Return the average cost of `operation()` per sample sentence in seconds."""
+    repeats = 0
+    start = time.perf_counter()
+    while True:
+        operation()
+        repeats += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= AUTO_MIN_BENCHMARK_SECONDS:
+            return elapsed / repeats / max(1, sample_len)
+
+
+def echo_messages(comm, transport):
+    """Rank 1 side of the message calibration: send every chunk back to rank 0."""
+    for _ in range(2 * AUTO_PINGS):
+        send_chunk(comm, recv_chunk(comm, 0, 98, transport), 0, 98, transport)
+
+
+def measure_round_trip(comm, chunk, transport):
+    """Rank 0 side of the message calibration: average one-way time of `chunk` (None: empty)."""
+    start = time.perf_counter()
+    for _ in range(AUTO_PINGS):
+        send_chunk(comm, chunk, 1, 98, transport)
+        recv_chunk(comm, 1, 98, transport)
+    return (time.perf_counter() - start) / (2 * AUTO_PINGS)
+
+
+def profile_input(comm, sentences, vocabulary, stopwords_set, transport='pickle', dedup=False):
+    """
+    Sample the input and measure the per-sentence cost of each NLP operation.
+    
+    The operations run on chunks of the selected transport, and message
+    costs are measured with real send_chunk()/recv_chunk() round trips to
+    rank 1, which must run echo_messages() at the same time. With dedup,
+    the stages that use a cache (all of them with the pickle transport, only
+    TF counting with the packed one) are charged for the distinct sentences
+    of the whole input only.
+    
+    Args:
+        comm: MPI communicator
+        sentences: All input sentences
+        vocabulary: Vocabulary (set or compiled PhraseAutomaton)
+        stopwords_set: Set of stopwords
+        transport: Chunk transport ('pickle' or 'packed')
+        dedup: Whether repeated sentences are processed only once
+        
+    Returns:
+        Dictionary with the input statistics and the per-sentence costs (seconds)
+    """
+    step = max(1, len(sentences) // AUTO_SAMPLE_SIZE)
+    sample = make_chunk(sentences[::step][:AUTO_SAMPLE_SIZE], transport)
+    lowered = lowercase_chunk(sample)
+    no_punctuation = remove_punctuation_chunk(lowered)
+    preprocessed = remove_stopwords_chunk(no_punctuation, stopwords_set)
+    
+    sample_sentences = chunk_sentences(sample)
+    tokens = [word for sentence in chunk_sentences(preprocessed) for word in sentence.split()]
+    hits = sum(compute_term_frequency(chunk_sentences(preprocessed), vocabulary).values())
+    # Share of the work left with --dedup (cache lookups are not charged)
+    distinct_fraction = len(set(sentences)) / max(1, len(sentences))
+    tf_fraction = distinct_fraction if dedup else 1.0
+    preprocessing_fraction = tf_fraction if transport != 'packed' else 1.0
+    
+    n = len(sample_sentences)
+    latency = measure_round_trip(comm, None, transport)
+    sample_time = measure_round_trip(comm, sample, transport)
+    return {
+        'lines': len(sentences),
+        'average_length': sum(len(sentence) for sentence in sample_sentences) / max(1, n),
+        'vocabulary_hit_rate': hits / max(1, len(tokens)),
+        'distinct_fraction': distinct_fraction,
+        'lowercase': preprocessing_fraction * time_operation(lambda: lowercase_chunk(sample), n),
+        'punctuation': preprocessing_fraction * time_operation(
+            lambda: remove_punctuation_chunk(lowered), n),
+        'stopwords': preprocessing_fraction * time_operation(
+            lambda: remove_stopwords_chunk(no_punctuation, stopwords_set), n),
+        'preprocess': preprocessing_fraction * time_operation(
+            lambda: preprocess_chunk(sample, stopwords_set), n),
+        'tf': tf_fraction * time_operation(
+            lambda: term_frequency_chunk(preprocessed, vocabulary), n),
+        'latency': latency,
+        'transfer': max(0.0, sample_time - latency) / max(1, n),
+    }
+
+
+def auto_layout_size(pattern, size):
+    """Largest number of ranks <= size on which `pattern` can run, or None."""
+    if pattern == 1:
+        return size if size >= 2 else None
+    if pattern == 2:
+        return 5 if size >= 5 else None
+    if pattern == 3:
+        return 1 + 4 * ((size - 1) // 4) if size >= 5 else None
+    return None
+
+
+def predict_pattern_time(pattern, used_size, profile, cores):
+    """
+    Predict the run time of a pattern on `used_size` ranks.
+    
+    Compute work is divided over the busy ranks, but never over more ranks
+    than there are cores. The manager's sends are sequential. A pipeline runs
+    at the pace of its slowest stage and pays an extra fill/drain time of
+    about one chunk passing through all stages.
+    """
+    n = profile['lines']
+    transfer = profile['transfer']
+    latency = profile['latency']
+    workers = used_size - 1
+    
+    if pattern == 1:
+        send_time = n * transfer + workers * latency
+        compute = n * (profile['preprocess'] + profile['tf'] + transfer)
+        return send_time + compute / min(workers, cores)
+    
+    num_pipelines = workers // 4
+    chunk_messages = PIPELINE_CHUNK_DIVISOR + 1
+    stage_times = [n / num_pipelines * (profile[stage] + 2 * transfer)
+                   + chunk_messages * 2 * latency
+                   for stage in ('lowercase', 'punctuation', 'stopwords', 'tf')]
+    steady = max(max(stage_times), sum(stage_times) * num_pipelines / min(workers, cores))
+    fill = sum(stage_times) / PIPELINE_CHUNK_DIVISOR
+    return n * transfer + steady + fill
+
+
+def choose_pattern(comm, sentences, vocabulary, stopwords_set, size, transport='pickle',
+                   dedup=False):
+    """
+    Choose the pattern and number of ranks with the lowest predicted run time.
+    
+    The transport and dedup settings of the run are passed to profile_input().
+    
+    Returns:
+        Tuple (pattern, used_size, predicted seconds, profile, predictions),
+        or None if no candidate pattern fits `size`
+    """
+    if size < 2:
+        return None
+    profile = profile_input(comm, sentences, vocabulary, stopwords_set, transport, dedup)
+    cores = available_cores()
+    predictions = {}
+    for pattern in AUTO_PATTERNS:
+        used_size = auto_layout_size(pattern, size)
+        if used_size is not None:
+            predictions[pattern] = (used_size, predict_pattern_time(pattern, used_size,
+                                                                    profile, cores))
+    if not predictions:
+        return None
+    pattern = min(predictions, key=lambda candidate: predictions[candidate][1])
+    used_size, predicted = predictions[pattern]
+    return pattern, used_size, predicted, profile, predictions
+
+
+def log_auto_choice(choice, size):
+    """Log the input profile and the prediction for each candidate to stderr."""
+    pattern, used_size, predicted, profile, predictions = choice
+    print(f"Auto: {profile['lines']} lines, average length {profile['average_length']:.1f}, "
+          f"vocabulary hit rate {profile['vocabulary_hit_rate']:.3f}, "
+          f"distinct sentences {profile['distinct_fraction']:.3f}, "
+          f"message latency {profile['latency'] * 1e6:.1f}us", file=sys.stderr)
+    for candidate, (candidate_size, candidate_time) in sorted(predictions.items()):
+        print(f"Auto: pattern #{candidate} on {candidate_size} processes: "
+              f"predicted {candidate_time:.6f}s", file=sys.stderr)
+    print(f"Auto: chose pattern #{pattern} on {used_size} of {size} processes", file=sys.stderr)
+
+
+# ---------------------------------------------------------------------------
+# Service mode
+#
+# The MPI job stays up and processes many jobs. Clients drop "<name>.job"
+# files (JSON with "text", "vocab", "stopwords", "pattern") into a spool
+# directory; rank 0 picks them up in name order, dispatches them to the warm
+# workers and writes the pattern output to "<name>.result". A job file
+# containing {"shutdown": true} stops the service.
+#
+# Parsed vocabularies and stopword sets are cached, keyed by file path and
+# modification time. Stopword sets and compiled (combined) vocabularies are
+# shipped to the workers only the first time they are used. Rank 0 decides
+# what is evicted (older versions of a changed file, and the least recently
+# used entries beyond SERVICE_CACHE_SIZE) and tells the workers with the job.
+# ---------------------------------------------------------------------------
+
+SERVICE_POLL_SECONDS = 0.2
+SERVICE_CACHE_SIZE = 32  # Word lists and compiled vocabularies (each) cached per rank
+
+
+def file_cache_key(filepath):
+    """Cache key of a file: its absolute path and modification time."""
+    return (os.path.abspath(filepath), os.stat(filepath).st_mtime_ns)
+
+
+def write_spool_file(path, content):
+    """Write a spool file atomically (write to a temporary name, then rename)."""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+def next_spool_job(spool_dir, skipped=frozenset()):
+    """Return the path of the next job file in the spool directory (not in `skipped`), or None."""
+    job_names = sorted(name for name in os.listdir(spool_dir)
+                       if name.endswith('.job') and name not in skipped)
+    if not job_names:
+        return None
+    return os.path.join(spool_dir, job_names[0])
+
+
+def parse_job(job_text, size):
+    """
+    Parse and validate the contents of a job file.
+    
+    Args:
+        job_text: Contents of the job file
+        size: Number of processes of the service
+        
+    Returns:
+        Tuple (request, error): the request dictionary ("vocab" always a list,
+        "tasks" a tuple) and None, or None and an error message
+    """
+    try:
+        request = json.loads(job_text)
+    except ValueError as e:
+        return None, f"Error: invalid JSON: {e}"
+    if not isinstance(request, dict):
+        return None, "Error: a job must be a JSON object"
+    if request.get('shutdown'):
+        return {'shutdown': True}, None
+    
+    try:
+        # "vocab" may be a single path or a list of paths (batch evaluation)
+        vocab_paths = request['vocab']
+        if isinstance(vocab_paths, str):
+            vocab_paths = [vocab_paths]
+        tasks = request.get('tasks', list(DEFAULT_TASKS))
+        paths = [request['text'], request['stopwords']]
+        if not (isinstance(vocab_paths, list) and vocab_paths and isinstance(tasks, list)
+                and all(isinstance(item, str) for item in vocab_paths + tasks + paths)):
+            return None, ('Error: "text", "stopwords" and "vocab" must be paths '
+                          '("vocab" may be a list) and "tasks" a list of names')
+        parsed = {'pattern': int(request['pattern']), 'tasks': tuple(tasks),
+                  'ngrams': int(request.get('ngrams', 0)), 'text': request['text'],
+                  'vocab': vocab_paths, 'stopwords': request['stopwords']}
+    except KeyError as e:
+        return None, f"Error: missing field {e}"
+    except (TypeError, ValueError) as e:
+        return None, f"Error: invalid field: {e}"
+    
+    error = validate_tasks(parsed['tasks']) or validate_process_count(
+        parsed['pattern'], size, len(parsed['tasks']), parsed['ngrams'])
+    if parsed['pattern'] not in (1, 2, 3, 4):
+        error = f"Error: unknown pattern {parsed['pattern']}"
+    elif parsed['ngrams'] < 0:
+        error = f"Error: --ngrams requires N >= 1, got {parsed['ngrams']}"
+    return (None, error) if error is not None else (parsed, None)
+
+
+def evict_cache_entries(cache, keep, is_stale, limit):
+    """
+    Remove stale entries and, beyond `limit`, the least recently used ones.
+    
+    Args:
+        cache: OrderedDict in least recently used first order
+        keep: Keys used by the current job (never removed)
+        is_stale: Function telling whether a key refers to an outdated file
+        limit: Maximum number of entries
+        
+    Returns:
+        List of the removed keys
+    """
+    removed = [key for key in cache if key not in keep and is_stale(key)]
+    for key in list(cache):
+        if len(cache) - len(removed) <= limit:
+            break
+        if key not in keep and key not in removed:
+            removed.append(key)
+    for key in removed:
+        del cache[key]
+    return removed
+
+
+def prepare_job(request, word_set_cache, compiled_cache, worker_stopwords):
+    """
+    Load the files of a parsed job on rank 0 and build the job message for the workers.
+    
+    The caches are only updated once everything was read and validated, so a
+    failing job never leaves rank 0 believing that the workers have words
+    they were not sent.
+    
+    Args:
+        request: Request returned by parse_job()
+        word_set_cache: Rank 0's OrderedDict cache key -> set of words
+        compiled_cache: Rank 0's OrderedDict tuple of vocabulary keys -> compiled vocabulary
+        worker_stopwords: Set of the stopword cache keys the workers hold (updated in place);
+            rank 0 also caches vocabulary files, which the workers never receive as words
+        
+    Returns:
+        Tuple (job message, error message); exactly one of them is None
+    """
+    keys = [file_cache_key(path) for path in request['vocab'] + [request['stopwords']]]
+    vocab_keys = tuple(keys[:-1])
+    loaded = {key: read_file_lines(path)
+              for key, path in zip(keys, request['vocab'] + [request['stopwords']])
+              if key not in word_set_cache}
+    
+    def words(key):
+        return word_set_cache[key] if key in word_set_cache else set(loaded[key])
+    
+    vocabulary = compiled_cache.get(vocab_keys)
+    new_vocabulary = None
+    if vocabulary is None:
+        vocabulary = new_vocabulary = compile_vocabulary(
+            set().union(*(words(key) for key in vocab_keys)))
+    if request['ngrams']:
+        error = validate_ngrams(request['ngrams'], vocabulary)
+        if error is not None:
+            return None, error
+    
+    # Everything is valid: update the caches and evict what is no longer needed
+    for key in keys:
+        word_set_cache[key] = words(key)
+        word_set_cache.move_to_end(key)
+    compiled_cache[vocab_keys] = vocabulary
+    compiled_cache.move_to_end(vocab_keys)
+    job_paths = {key[0] for key in keys}
+    evicted_words = evict_cache_entries(word_set_cache, set(keys),
+                                        lambda key: key[0] in job_paths, SERVICE_CACHE_SIZE)
+    evicted_vocabularies = evict_cache_entries(
+        compiled_cache, {vocab_keys},
+        lambda cached: any(key[0] in job_paths and key not in keys for key in cached),
+        SERVICE_CACHE_SIZE)
+    
+    # Workers only need the stopword lists and the compiled combined vocabulary
+    stopwords_key = keys[-1]
+    worker_stopwords.difference_update(evicted_words)
+    new_words = {}
+    if stopwords_key not in worker_stopwords:
+        new_words[stopwords_key] = word_set_cache[stopwords_key]
+        worker_stopwords.add(stopwords_key)
+    return {'pattern': request['pattern'], 'tasks': request['tasks'],
+            'ngrams': request['ngrams'], 'vocab_keys': vocab_keys, 'stopwords_key': stopwords_key,
+            'new_words': new_words, 'new_vocabulary': new_vocabulary,
+            'evicted_words': evicted_words, 'evicted_vocabularies': evicted_vocabularies}, None
+
+
+def serve(comm, rank, size, spool_dir, transport, dedup=False):
+    """
+    Run the persistent service loop on every rank.
+    
+    Rank 0 polls the spool directory and, for each valid job, sends the job
+    description to all workers (tag 20) before running the pattern, so all
+    ranks enter the same pattern function. None as the job description
+    shuts the workers down. Invalid jobs only get an error result; they are
+    never sent to the workers.
+    """
+    word_set_cache = OrderedDict()  # cache key -> set of words (vocabulary or stopwords)
+    compiled_cache = OrderedDict()  # tuple of vocabulary cache keys -> compiled vocabulary
+    worker_stopwords = set()        # Rank 0: stopword cache keys the workers hold
+    
+    if rank != 0:  # Worker process: wait for job descriptions
+        while True:
+            job = comm.recv(source=0, tag=20)
+            if job is None:
+                break
+            for key in job['evicted_words']:
+                word_set_cache.pop(key, None)
+            for vocab_keys in job['evicted_vocabularies']:
+                compiled_cache.pop(vocab_keys, None)
+            vocab_keys = tuple(job['vocab_keys'])
+            for key, words in job['new_words'].items():
+                word_set_cache[key] = set(words)
+            if job['new_vocabulary'] is not None:
+                compiled_cache[vocab_keys] = job['new_vocabulary']
+            run_pattern(job['pattern'], comm, rank, size, None, compiled_cache[vocab_keys],
+                        word_set_cache[job['stopwords_key']], transport, dedup, job['tasks'],
+                        job['ngrams'])
+        return
+    
+    skipped = set()  # Names of unreadable job entries that could not be moved aside
+    os.makedirs(spool_dir, exist_ok=True)
+    print(f"Service started with {size} processes, spool directory: {spool_dir}", flush=True)
+    
+    while True:
+        job_path = next_spool_job(spool_dir, skipped)
+        if job_path is None:
+            time.sleep(SERVICE_POLL_SECONDS)
+            continue
+        
+        job_name = os.path.basename(job_path)
+        result_path = job_path[:-len('.job')] + '.result'
+        try:
+            with open(job_path, 'rb') as f:
+                job_text = f.read()
+            os.remove(job_path)
+        except OSError as e:
+            # A directory or an unreadable file: report it and rename it to
+            # "<name>.job.failed", or at least never pick it up again
+            print(f"Job {job_name} skipped: {e}", flush=True)
+            skipped.add(job_name)
+            with contextlib.suppress(OSError):
+                write_spool_file(result_path, f"Error: job {job_name} skipped: {e}\n")
+                os.replace(job_path, job_path + '.failed')
+                skipped.discard(job_name)
+            time.sleep(SERVICE_POLL_SECONDS)
+            continue
+        
+        try:
+            request, error = parse_job(job_text, size)
+            if error is None and not request.get('shutdown'):
+                sentences = read_file_lines(request['text'])
+                job, error = prepare_job(request, word_set_cache, compiled_cache,
+                                         worker_stopwords)
+        except Exception as e:  # One bad job must not stop the service
+            request = None
+            error = f"Error: invalid job {job_name}: {e}"
+        if request is not None and request.get('shutdown'):
+            write_spool_file(result_path, "Service stopped\n")
+            break
+        if error is not None:
+            write_spool_file(result_path, error + "\n")
+            continue
+        
+        for other_rank in range(1, size):
+            comm.send(job, dest=other_rank, tag=20)
+        
+        pattern = job['pattern']
+        vocab_keys = job['vocab_keys']
+        start_time = time.perf_counter()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            tf, df, statistics = run_pattern(pattern, comm, rank, size, sentences,
+                                             compiled_cache[vocab_keys],
+                                             word_set_cache[job['stopwords_key']], transport,
+                                             dedup, job['tasks'], job['ngrams'])
+            print_batch_results(pattern, tf, df, request['vocab'],
+                                [word_set_cache[key] for key in vocab_keys], statistics)
+        write_spool_file(result_path, output.getvalue())
+        print(f"Job {job_name} finished in {time.perf_counter() - start_time:.3f}s", flush=True)
+    
+    # Shut down the workers
+    for other_rank in range(1, size):
+        comm.send(None, dest=other_rank, tag=20)
+
+
+# ---------------------------------------------------------------------------
+# Streaming mode (--stream, Pattern #2 only)
+#
+# Rank 0 reads an unbounded input (stdin, or a file that keeps growing) and
+# pushes micro-batches through the unchanged stages 1-3 of the linear
+# pipeline as soon as lines arrive. Every --snapshot-lines lines or
+# --snapshot-seconds seconds it also pushes a snapshot marker (an empty
+# chunk; real micro-batches are never empty) and sends the marker's line
+# range and timestamp to rank 4 directly (tag 6). Because the marker travels
+# behind the lines before it, the TF stage prints exactly the counts of those
+# lines when it arrives: cumulative, or over the last --window intervals.
+# Rank 4 acknowledges every batch and marker (tag 7) and rank 0 never has
+# more than STREAM_MAX_IN_FLIGHT of them unacknowledged, which bounds the
+# queued data and so the end-to-end latency.
+# ---------------------------------------------------------------------------
+
+STREAM_BATCH_LINES = 256     # Upper bound on the lines of one micro-batch
+STREAM_MAX_IN_FLIGHT = 8     # Unacknowledged batches/markers between rank 0 and rank 4
+STREAM_POLL_SECONDS = 0.05   # Polling interval while a followed file does not grow
+STREAM_READ_BYTES = 65536
+
+
+class StreamReader:
+    """Reads complete, non-empty lines from stdin ('-') or a growing file."""
+    
+    def __init__(self, path):
+        self.is_stdin = path == '-'
+        self.fd = sys.stdin.fileno() if self.is_stdin else os.open(path, os.O_RDONLY)
+        self.partial = b''   # Bytes after the last line terminator
+        self.lines = deque()  # Complete lines not handed out yet
+        self.eof = False     # Only stdin ends; a file is followed until the stream stops
+    
+    def read_lines(self, timeout, max_lines):
+        """
+        Return up to `max_lines` lines, waiting at most `timeout` seconds for input.
+        
+        Lines are stripped and empty lines are skipped, like read_file_lines().
+        Returns an empty list if no complete line arrived in time.
+        """
+        if not self.lines and not self.eof:
+            self._fill(timeout)
+        count = min(max_lines, len(self.lines))
+        return [self.lines.popleft() for _ in range(count)]
+    
+    def _fill(self, timeout):
+        if self.is_stdin:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            data = os.read(self.fd, STREAM_READ_BYTES) if ready else None
+            if data == b'':
+                self.eof = True
+                data = b'\n'  # Terminates a last line without a line break
+        else:
+            data = os.read(self.fd, STREAM_READ_BYTES)
+            if not data:
+                time.sleep(min(timeout, STREAM_POLL_SECONDS))
+        if data:
+            *complete, self.partial = (self.partial + data).split(b'\n')
+            for line in complete:
+                line = line.decode('utf-8').strip()
+                if line:
+                    self.lines.append(line)
+    
+    def close(self):
+        if not self.is_stdin:
+            os.close(self.fd)
+
+
+def stream_manager(comm, reader, transport, snapshot_lines, snapshot_seconds, idle_seconds):
+    """
+    Rank 0 of a stream: read the input and feed micro-batches and snapshot markers to rank 1.
+    
+    Args:
+        comm: Communicator
+        reader: StreamReader
+        transport: Chunk transport
+        snapshot_lines: Lines between two snapshots
+        snapshot_seconds: Seconds between two snapshots (if there are new lines)
+        idle_seconds: End a followed file after this many seconds without new lines (0: never)
+    """
+    in_flight = 0
+    
+    def push(chunk):
+        nonlocal in_flight
+        if in_flight >= STREAM_MAX_IN_FLIGHT:
+            comm.recv(source=4, tag=7)
+            in_flight -= 1
+        send_chunk(comm, chunk, 1, 1, transport)
+        in_flight += 1
+    
+    lines_read = 0
+    snapshot_start = 0  # Lines read before the current snapshot interval
+    last_snapshot = last_input = time.monotonic()
+    
+    while True:
+        now = time.monotonic()
+        if lines_read > snapshot_start:
+            timeout = max(0.0, last_snapshot + snapshot_seconds - now)
+        else:
+            timeout = snapshot_seconds
+        lines = reader.read_lines(timeout, min(STREAM_BATCH_LINES,
+                                               snapshot_start + snapshot_lines - lines_read))
+        now = time.monotonic()
+        if lines:
+            push(make_chunk(lines, transport))
+            lines_read += len(lines)
+            last_input = now
+        elif lines_read == snapshot_start:
+            last_snapshot = now  # Nothing to report; the interval starts with the next line
+        
+        stopping = ((reader.eof and not reader.lines)
+                    or (idle_seconds and now - last_input >= idle_seconds))
+        if lines_read > snapshot_start and (lines_read - snapshot_start >= snapshot_lines
+                                            or now - last_snapshot >= snapshot_seconds
+                                            or stopping):
+            comm.send((snapshot_start + 1, lines_read, time.time()), dest=4, tag=6)
+            push(make_chunk([], transport))
+            snapshot_start = lines_read
+            last_snapshot = now
+        if stopping:
+            break
+    
+    send_chunk(comm, None, 1, 1, transport)
+    for _ in range(in_flight):
+        comm.recv(source=4, tag=7)
+
+
+def stream_tf_stage(comm, vocabulary, transport, window, vocab_names, vocabularies, dedup=False):
+    """
+    Rank 4 of a stream: count TF and DF and print a snapshot at every marker.
+    
+    Args:
+        comm: Communicator
+        vocabulary: Combined vocabulary (set or compiled PhraseAutomaton)
+        transport: Chunk transport
+        window: Number of snapshot intervals a snapshot covers (0: cumulative)
+        vocab_names: Vocabulary file names (for batch output)
+        vocabularies: Per-vocabulary word sets (for batch output)
+        dedup: Deduplicate repeated sentences
+    """
+    cache = stage_cache(dedup, 'TF counting')
+    total_tf = {word: 0 for word in vocabulary}
+    total_df = {word: 0 for word in vocabulary}
+    interval_tf = dict(total_tf)
+    interval_df = dict(total_df)
+    intervals = deque()  # (TF, DF) of the intervals inside the window
+    snapshot = 0
+    
+    while True:
+        chunk = recv_chunk(comm, 3, 4, transport)
+        if chunk is None:  # Termination signal
+            break
+        comm.send(None, dest=0, tag=7)
+        
+        if len(chunk) > 0:
+            if cache is not None:
+                chunk_tf, chunk_df = deduplicated_frequencies(chunk_sentences(chunk), vocabulary,
+                                                              cache)
+            else:
+                chunk_tf = term_frequency_chunk(chunk, vocabulary)
+                chunk_df = document_frequency_chunk(chunk, vocabulary)
+            for word in vocabulary:
+                interval_tf[word] += chunk_tf[word]
+                interval_df[word] += chunk_df[word]
+            continue
+        
+        # Snapshot marker: close the interval and print the cumulative or windowed counts
+        first_line, last_line, sent_time = comm.recv(source=0, tag=6)
+        for word in vocabulary:
+            total_tf[word] += interval_tf[word]
+            total_df[word] += interval_df[word]
+        if window:
+            intervals.append((interval_tf, interval_df, first_line))
+            if len(intervals) > window:
+                old_tf, old_df, _ = intervals.popleft()
+                for word in vocabulary:
+                    total_tf[word] -= old_tf[word]
+                    total_df[word] -= old_df[word]
+            first_line = intervals[0][2]
+        else:
+            first_line = 1
+        interval_tf = {word: 0 for word in vocabulary}
+        interval_df = {word: 0 for word in vocabulary}
+        
+        snapshot += 1
+        print(f"Snapshot {snapshot}: lines {first_line}-{last_line} "
+              f"(latency {(time.time() - sent_time) * 1000:.1f} ms)")
+        print_batch_results(2, total_tf, total_df, vocab_names, vocabularies)
+        sys.stdout.flush()
+    
+    report_caches(4, cache)
+
+
+def stream_pattern2(comm, rank, args, vocabulary, stopwords_set, vocab_names, vocabularies):
+    """Run Pattern #2 on an unbounded input (all ranks); stages 1-3 are the usual ones."""
+    if rank == 0:
+        reader = StreamReader(args.text)
+        try:
+            comm.send((vocab_names, vocabularies), dest=4, tag=12)
+            stream_manager(comm, reader, args.transport, args.snapshot_lines,
+                           args.snapshot_seconds, args.stream_idle)
+        finally:
+            reader.close()
+    elif rank == 4:
+        vocab_names, vocabularies = comm.recv(source=0, tag=12)
+        stream_tf_stage(comm, vocabulary, args.transport, args.window, vocab_names,
+                        vocabularies, args.dedup)
+    else:
+        pattern2(comm, rank, 5, None, vocabulary, stopwords_set, args.transport, args.dedup)
+
+
+# ---------------------------------------------------------------------------
+# Local execution backend (--backend local)
+#
+# Runs the unchanged pattern functions on one host without mpiexec/mpi4py:
+# every rank is a multiprocessing process and LocalComm provides the small
+# subset of the mpi4py communicator API this program uses (Get_rank,
+# Get_size, blocking send/recv and buffer-based Send/Recv). Every rank has
+# one inbound one-way pipe that all other ranks write (source, tag, object)
+# messages to, so N ranks need N pipes. Like MPI, messages from the same
+# source with the same tag are received in order; a message from another
+# source or with another tag that arrives first is kept until a matching
+# recv() asks for it. A rank waiting for a message checks every
+# LOCAL_PEER_CHECK_SECONDS whether a peer process died, and raises EOFError
+# instead of waiting forever.
+# ---------------------------------------------------------------------------
+
+LOCAL_PEER_CHECK_SECONDS = 1.0
+
+
+class LocalComm:
+    """Point-to-point communicator over multiprocessing pipes."""
+    
+    def __init__(self, rank, size, inbound, outbound, locks):
+        self.rank = rank
+        self.size = size
+        self.inbound = inbound    # receiving end of this rank's pipe (messages from all sources)
+        self.outbound = outbound  # destination rank -> sending end of that rank's pipe
+        self.locks = locks        # destination rank -> lock serializing writes to its pipe
+        self.pending = {}         # (source, tag) -> deque of messages that arrived early
+        self.workers = None       # on rank 0 of run_local(): the worker processes (ranks 1..)
+    
+    def Get_rank(self):
+        return self.rank
+    
+    def Get_size(self):
+        return self.size
+    
+    def send(self, obj, dest, tag=0):
+        # All ranks write to the same pipe and a large message takes several writes
+        with self.locks[dest]:
+            self.outbound[dest].send((self.rank, tag, obj))
+    
+    def recv(self, source, tag=0):
+        queue = self.pending.get((source, tag))
+        if queue:
+            return queue.popleft()
+        while True:
+            self.wait_for_message()
+            message_source, message_tag, obj = self.inbound.recv()
+            if message_source == source and message_tag == tag:
+                return obj
+            self.pending.setdefault((message_source, message_tag), deque()).append(obj)
+    
+    def wait_for_message(self):
+        """Block until a message (or end of file) can be read; raise EOFError if a peer died."""
+        while not self.inbound.poll(LOCAL_PEER_CHECK_SECONDS):
+            if self.workers is not None:
+                failed = failed_ranks(self.workers)
+                if failed:
+                    raise EOFError(f"rank {failed[0][0]} exited with code {failed[0][1]}")
+            else:
+                parent = multiprocessing.parent_process()
+                if parent is not None and not parent.is_alive():
+                    raise EOFError("rank 0 exited")
+    
+    def Send(self, buffer_spec, dest, tag=0):
+        """Buffer send; `buffer_spec` is a buffer or [buffer, MPI datatype] as for mpi4py."""
+        buffer = buffer_spec[0] if isinstance(buffer_spec, list) else buffer_spec
+        self.send(bytes(memoryview(buffer)), dest, tag)
+    
+    def Recv(self, buffer_spec, source, tag=0):
+        """Buffer receive into a preallocated buffer of the right size."""
+        buffer = buffer_spec[0] if isinstance(buffer_spec, list) else buffer_spec
+        memoryview(buffer).cast('B')[:] = self.recv(source, tag)
+
+
+def failed_ranks(workers):
+    """(rank, exit code) of the worker processes (ranks 1..) that exited with an error."""
+    return [(rank, worker.exitcode) for rank, worker in enumerate(workers, 1)
+            if worker.exitcode not in (None, 0)]
+
+
+def run_local_worker(comm, args, unused):
+    """Entry point of a worker process: close the inherited pipe ends it does not use."""
+    for connection in unused:
+        connection.close()
+    run_rank(comm, args)
+
+
+def run_local(args, size):
+    """
+    Run `size` ranks as local processes: this process is rank 0, the
+    workers are child processes. Returns when all ranks have finished,
+    and exits with an error message if a worker failed.
+    """
+    # pipes[rank] = (receiving end, sending end) of the pipe into `rank`
+    pipes = [multiprocessing.Pipe(duplex=False) for rank in range(size)]
+    locks = [multiprocessing.Lock() for rank in range(size)]
+    
+    def local_comm(rank):
+        outbound = {dest: pipes[dest][1] for dest in range(size) if dest != rank}
+        lock_map = {dest: locks[dest] for dest in range(size) if dest != rank}
+        return LocalComm(rank, size, pipes[rank][0], outbound, lock_map)
+    
+    def unused_ends(rank):
+        # A rank never writes to its own pipe, so it sees end of file once all peers exited
+        return [pipes[other][0] for other in range(size) if other != rank] + [pipes[rank][1]]
+    
+    workers = [multiprocessing.Process(target=run_local_worker,
+                                       args=(local_comm(rank), args, unused_ends(rank)),
+                                       daemon=True)
+               for rank in range(1, size)]
+    for worker in workers:
+        worker.start()
+    for connection in unused_ends(0):
+        connection.close()
+    
+    comm = local_comm(0)
+    comm.workers = workers
+    try:
+        run_rank(comm, args)
+    except EOFError:
+        # A worker died (its traceback is already on stderr): collect the exit
+        # codes of the workers that ended, then stop the others
+        deadline = time.monotonic() + LOCAL_PEER_CHECK_SECONDS
+        for worker in workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+        failed = failed_ranks(workers)
+        if not failed:
+            raise
+        for worker in workers:
+            worker.terminate()
+    else:
+        for worker in workers:
+            worker.join()
+        failed = failed_ranks(workers)
+    if failed:
+        sys.exit("Error: " + ", ".join(f"rank {rank} exited with code {code}"
+                                       for rank, code in failed))
+
+
+def run_rank(comm, args):
+    """Everything one rank does for a run (or a service) once its communicator exists."""
     rank = comm.Get_rank()
     size = comm.Get_size()
     
+    if args.serve is not None:
+        serve(comm, rank, size, args.serve, args.transport, args.dedup)
+        return
+    
     # Read input files (all processes need vocabulary and stopwords)
     if rank == 0:
-        sentences = read_file_lines(args.text)
-        vocab_list = read_file_lines(args.vocab)
+        # A stream is read while it is processed (stream_pattern2)
+        sentences = None if args.stream else read_file_lines(args.text)
+        # Several vocabularies are merged so the corpus is counted only once
+        combined_vocabulary, vocabularies = merge_vocabularies(
+            [read_file_lines(path) for path in args.vocab])
         stopwords_list = read_file_lines(args.stopwords)
     else:
         sentences = None
-        vocab_list = None
         stopwords_list = None
     
     # Broadcast vocabulary and stopwords to all processes
-    # Since we can only use Send/Recv, we'll have rank 0 send to all others
+    # Since we can only use Send/Recv, we'll have rank 0 send to all others.
+    # A vocabulary with multi-word phrases is compiled once here and the
+    # compiled automaton is what the workers receive.
     if rank == 0:
+        vocabulary = compile_vocabulary(combined_vocabulary)
         for other_rank in range(1, size):
-            comm.send(vocab_list, dest=other_rank, tag=10)
+            comm.send(vocabulary, dest=other_rank, tag=10)
             comm.send(stopwords_list, dest=other_rank, tag=11)
-        vocabulary = set(vocab_list)
         stopwords_set = set(stopwords_list)
     else:
-        vocab_list = comm.recv(source=0, tag=10)
+        vocabulary = comm.recv(source=0, tag=10)
         stopwords_list = comm.recv(source=0, tag=11)
-        vocabulary = set(vocab_list)
         stopwords_set = set(stopwords_list)
     
-    # Validate process count for each pattern (rank 0 decides, then informs all ranks)
-    config_ok = True
+    # Choose or validate the pattern (rank 0 decides, then informs all ranks).
+    # The run configuration is (pattern, number of ranks used), or None if invalid.
     if rank == 0:
-        if args.pattern == 1 and size < 2:
-            print("Error: Pattern #1 requires at least 2 processes (1 manager + 1 worker)")
-            config_ok = False
-        elif args.pattern == 2 and size != 5:
-            print(f"Error: Pattern #2 requires exactly 5 processes, got {size}")
-            config_ok = False
-        elif args.pattern == 3 and (size - 1) % 4 != 0:
-            print(f"Error: Pattern #3 requires size = 1 + 4i (i >= 1), got {size}")
-            config_ok = False
-        elif args.pattern == 4 and (size - 1) % 2 != 0:
-            print(f"Error: Pattern #4 requires size = 1 + 2i (i >= 1), got {size}")
-            config_ok = False
-        
-        # Inform all other ranks about validity
+        run_config = None
+        auto_choice = None
+        if args.pattern == 'auto':
+            auto_choice = choose_pattern(comm, sentences, vocabulary, stopwords_set, size,
+                                         args.transport, args.dedup)
+            if auto_choice is None:
+                print(f"Error: --pattern auto requires at least 2 processes, got {size}")
+            else:
+                log_auto_choice(auto_choice, size)
+                run_config = auto_choice[:2]
+        else:
+            error = (validate_tasks(args.tasks)
+                     or validate_process_count(int(args.pattern), size, len(args.tasks),
+                                               args.ngrams))
+            if error is None and args.ngrams:
+                error = validate_ngrams(args.ngrams, vocabulary)
+            if error is not None:
+                print(error)
+            else:
+                run_config = (int(args.pattern), size)
+        
+        # Inform all other ranks about the configuration
         for other_rank in range(1, size):
-            comm.send(config_ok, dest=other_rank, tag=99)
+            comm.send(run_config, dest=other_rank, tag=99)
     else:
-        config_ok = comm.recv(source=0, tag=99)
+        if args.pattern == 'auto' and rank == 1:
+            echo_messages(comm, args.transport)
+        run_config = comm.recv(source=0, tag=99)
     
     # If configuration is invalid, all ranks exit without entering any pattern
-    if not config_ok:
+    if run_config is None:
+        return
+    
+    # Ranks outside the layout chosen by --pattern auto stay idle
+    pattern, used_size = run_config
+    if rank >= used_size:
+        return
+    
+    if args.stream:
+        stream_pattern2(comm, rank, args, vocabulary, stopwords_set,
+                        args.vocab if rank == 0 else None, vocabularies if rank == 0 else None)
         return
     
     # Execute the selected pattern
-    if args.pattern == 1:
-        pattern1(comm, rank, size, sentences, vocabulary, stopwords_set)
-    elif args.pattern == 2:
-        pattern2(comm, rank, size, sentences, vocabulary, stopwords_set)
-    elif args.pattern == 3:
-        pattern3(comm, rank, size, sentences, vocabulary, stopwords_set)
-    elif args.pattern == 4:
-        pattern4(comm, rank, size, sentences, vocabulary, stopwords_set)
+    start_time = time.perf_counter()
+    results = run_pattern(pattern, comm, rank, used_size, sentences, vocabulary, stopwords_set,
+                          args.transport, args.dedup, tuple(args.tasks), args.ngrams)
+    
+    # Print results (manager only), once per vocabulary in batch mode
+    if rank == 0:
+        elapsed = time.perf_counter() - start_time
+        tf, df, statistics = results
+        print_batch_results(pattern, tf, df, args.vocab, vocabularies, statistics)
+        if auto_choice is not None:
+            print(f"Auto: pattern #{pattern} finished in {elapsed:.6f}s "
+                  f"(predicted {auto_choice[2]:.6f}s)", file=sys.stderr)
+
+
+def main():
+    """Main function to parse arguments and execute the selected pattern."""
+    parser = argparse.ArgumentParser(description='MPI-Based Parallel NLP System')
+    parser.add_argument('--text', type=str, help='Path to input text file')
+    parser.add_argument('--vocab', type=str, nargs='+',
+                        help='Path to vocabulary file (several files are evaluated in one pass)')
+    parser.add_argument('--stopwords', type=str, help='Path to stopwords file')
+    parser.add_argument('--pattern', type=str, choices=['1', '2', '3', '4', 'auto'],
+                        help='Processing pattern (1, 2, 3, 4, or auto)')
+    parser.add_argument('--transport', type=str, choices=TRANSPORTS, default='pickle',
+                        help='Chunk transport: pickled sentence lists or packed UTF-8 buffers')
+    parser.add_argument('--tasks', type=str, nargs='+', default=list(DEFAULT_TASKS),
+                        help=f"Pattern #4 tasks, one per member of each worker group "
+                             f"(registered: {', '.join(TASKS)}; default: tf df)")
+    parser.add_argument('--ngrams', type=int, default=0, metavar='N',
+                        help='Also count N-grams of vocabulary words (adds a pipeline stage '
+                             'to patterns 2 and 3)')
+    parser.add_argument('--dedup', action='store_true',
+                        help='Process repeated sentences only once (hit rates are reported on stderr)')
+    parser.add_argument('--stream', action='store_true',
+                        help="Pattern #2 on an unbounded input: --text is followed as it grows "
+                             "('-' reads stdin) and TF/DF snapshots are printed periodically")
+    parser.add_argument('--snapshot-lines', type=int, default=1000, metavar='N',
+                        help='Streaming: print a snapshot every N lines (default: 1000)')
+    parser.add_argument('--snapshot-seconds', type=float, default=5.0, metavar='T',
+                        help='Streaming: ... or every T seconds if there are new lines (default: 5)')
+    parser.add_argument('--window', type=int, default=0, metavar='K',
+                        help='Streaming: snapshots cover the last K intervals (default: 0, cumulative)')
+    parser.add_argument('--stream-idle', type=float, default=0.0, metavar='SECONDS',
+                        help='Streaming: stop after SECONDS without new lines (default: 0, never)')
+    parser.add_argument('--serve', type=str, metavar='SPOOL_DIR',
+                        help='Run as a persistent service processing job files from SPOOL_DIR')
+    parser.add_argument('--backend', type=str, choices=['mpi', 'local'], default='mpi',
+                        help='Run under mpiexec (mpi) or as local processes without MPI (local)')
+    parser.add_argument('--np', type=int,
+                        help='Number of processes for the local backend (like mpiexec -n)')
+    
+    args = parser.parse_args()
+    if args.serve is None:
+        missing = [f'--{name}' for name in ('text', 'vocab', 'stopwords', 'pattern')
+                   if getattr(args, name) is None]
+        if missing:
+            parser.error(f"the following arguments are required: {', '.join(missing)}")
+    if args.stream:
+        if args.pattern != '2' or args.ngrams or args.serve is not None:
+            parser.error("--stream requires --pattern 2 and cannot be combined with "
+                         "--ngrams or --serve")
+        if args.snapshot_lines < 1 or args.snapshot_seconds <= 0 or args.window < 0:
+            parser.error("--snapshot-lines and --snapshot-seconds must be positive, "
+                         "--window must not be negative")
+    if args.ngrams < 0:
+        parser.error("--ngrams requires N >= 1 (or 0 to disable n-gram counting)")
+    if args.pattern == 'auto' and args.ngrams:
+        parser.error("--ngrams cannot be combined with --pattern auto (the cost model "
+                     "assumes 4-stage pipelines)")
+    if args.backend == 'local' and (args.np is None or args.np < 1):
+        parser.error("--backend local requires --np N (N >= 1)")
+    
+    if args.backend == 'local':
+        run_local(args, args.np)
+        return
+    
+    # Initialize MPI
+    if MPI is None:
+        parser.error("mpi4py is not installed, use --backend local")
+    if not MPI.Is_initialized():
+        MPI.Init()
+    try:
+        run_rank(MPI.COMM_WORLD, args)
+    finally:
+        if not MPI.Is_finalized():
+            MPI.Finalize()
 
 
 if __name__ == '__main__':
     main()
-
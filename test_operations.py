@@ -193,7 +193,493 @@ def test_with_sample_files():
         print("Skipping sample file test.")
 
 
+def test_packed_chunk_operations():
+    """Test that the packed chunk transport gives the same results as plain lists."""
+    from solution import (PackedChunk, preprocess_chunk, term_frequency_chunk,
+                          document_frequency_chunk, concat_chunks)
+    
+    print("\n" + "=" * 60)
+    print("Testing packed chunk operations")
+    print("=" * 60)
+    
+    sentences = [
+        "The cat, the old cat, sat on the mat; the cat was tired.",
+        "",
+        "A small cat chased the big dog! The cat didn't stop.",
+        "Dogs are bigger than cats, but a cat is faster.",
+        "ÇOK BÜYÜK bir Kedi, cat!"
+    ]
+    vocabulary = {'cat', 'dog', 'old', 'büyük'}
+    stopwords_set = {'the', 'a', 'on', 'in', 'are', 'than', 'was', 'but', 'bir'}
+    
+    packed = PackedChunk.from_sentences(sentences)
+    assert len(packed) == len(sentences)
+    assert packed.sentences() == sentences
+    assert packed.data[packed.offsets[2]:packed.offsets[3] - 1] == sentences[2].encode('utf-8')
+    
+    # ASCII-only and mixed chunks must both match the list path exactly
+    for chunk_sentences in (sentences[:4], sentences):
+        expected = preprocess_sentences(chunk_sentences, stopwords_set)
+        packed_result = preprocess_chunk(PackedChunk.from_sentences(chunk_sentences), stopwords_set)
+        assert packed_result.sentences() == expected, f"{packed_result.sentences()} != {expected}"
+        assert term_frequency_chunk(packed_result, vocabulary) == \
+            compute_term_frequency(expected, vocabulary)
+        assert document_frequency_chunk(packed_result, vocabulary) == \
+            compute_document_frequency(expected, vocabulary)
+    
+    combined = concat_chunks(PackedChunk.from_sentences(sentences[:2]),
+                             PackedChunk.from_sentences(sentences[2:]))
+    assert combined.sentences() == sentences
+    assert list(combined.offsets) == list(PackedChunk.from_sentences(sentences).offsets)
+    print("✓ Packed chunk results match the list results!")
+
+
+def test_batch_vocabularies():
+    """Test that counting against merged vocabularies matches separate runs."""
+    from solution import merge_vocabularies
+    
+    print("\n" + "=" * 60)
+    print("Testing batch evaluation of several vocabularies")
+    print("=" * 60)
+    
+    sentences = preprocess_sentences([
+        "The cat, the old cat, sat on the mat; the cat was tired.",
+        "A small cat chased the big dog! The cat didn't stop.",
+        "Dogs are bigger than cats, but a cat is faster."
+    ], {'the', 'a', 'on', 'in', 'are', 'than', 'was', 'but'})
+    vocab_lists = [['cat', 'dog'], ['old', 'cat', 'mat'], ['faster']]
+    
+    combined, vocabularies = merge_vocabularies(vocab_lists)
+    assert combined == {'cat', 'dog', 'old', 'mat', 'faster'}
+    
+    tf = compute_term_frequency(sentences, combined)
+    df = compute_document_frequency(sentences, combined)
+    for vocab_list, vocabulary in zip(vocab_lists, vocabularies):
+        assert {word: tf[word] for word in vocabulary} == \
+            compute_term_frequency(sentences, set(vocab_list))
+        assert {word: df[word] for word in vocabulary} == \
+            compute_document_frequency(sentences, set(vocab_list))
+    print("✓ Projected batch results match separate runs!")
+
+
+def test_phrase_vocabulary():
+    """Test multi-word phrase counting with the compiled automaton."""
+    # The local copies above only handle plain word sets
+    from solution import (PhraseAutomaton, compile_vocabulary,
+                          compute_term_frequency, compute_document_frequency)
+    
+    print("\n" + "=" * 60)
+    print("Testing phrase vocabulary counting")
+    print("=" * 60)
+    
+    sentences = [
+        "machine learning beats deep machine learning",
+        "new york new york city",
+        "learning machine",
+        "york city machine",
+        "learning new york",
+    ]
+    vocabulary = {'machine learning', 'machine', 'new york', 'new york city', 'york city', 'city'}
+    
+    assert compile_vocabulary({'cat', 'dog'}) == {'cat', 'dog'}
+    automaton = compile_vocabulary(vocabulary)
+    assert isinstance(automaton, PhraseAutomaton)
+    assert set(automaton) == vocabulary
+    
+    def naive_counts(phrase):
+        tokens = phrase.split()
+        tf = df = 0
+        for sentence in sentences:
+            words = sentence.split()
+            hits = sum(1 for i in range(len(words) - len(tokens) + 1)
+                       if words[i:i + len(tokens)] == tokens)
+            tf += hits
+            df += 1 if hits else 0
+        return tf, df
+    
+    tf = compute_term_frequency(sentences, automaton)
+    df = compute_document_frequency(sentences, automaton)
+    for phrase in sorted(vocabulary):
+        print(f"  {phrase}: TF={tf[phrase]} DF={df[phrase]}")
+        assert (tf[phrase], df[phrase]) == naive_counts(phrase), phrase
+    
+    # Phrases never match across sentence boundaries
+    assert compute_term_frequency(["machine", "learning"], automaton)['machine learning'] == 0
+    print("✓ Phrase counts match the naive scan!")
+
+
+def test_ascii_normalization():
+    """Test that the ASCII byte-level fast paths give the same results as the str path."""
+    import solution
+    
+    print("\n" + "=" * 60)
+    print("Testing ASCII normalization fast path")
+    print("=" * 60)
+    
+    ascii_sentences = [
+        "The cat, the old cat, sat on the mat; the cat was tired.",
+        "",
+        "A small cat chased the big DOG! The cat didn't stop...",
+        "Tabs\tand\x1cseparators -- [brackets] {braces} (parens) @#$%^&*~`|\\/<>",
+    ]
+    mixed_sentences = ascii_sentences + ["ÇOK BÜYÜK bir Kedi, İstanbul'da!"]
+    
+    for sentences in (ascii_sentences, mixed_sentences, [], ["line\nbreak, INSIDE"]):
+        # The local copies in this file are the reference str implementations
+        expected_lower = lowercase_text(sentences)
+        expected = remove_punctuation(expected_lower)
+        assert solution.lowercase_text(sentences) == expected_lower
+        assert solution.remove_punctuation(expected_lower) == expected
+        assert solution.normalize_text(sentences) == expected, solution.normalize_text(sentences)
+        assert solution.preprocess_sentences(sentences, {'the'}) == \
+            preprocess_sentences(sentences, {'the'})
+    
+    assert solution.ascii_translate(mixed_sentences, solution.ASCII_LOWER_TABLE) is None
+    print("✓ Fast path results match the str path!")
+
+
+def test_auto_pattern_layouts():
+    """Test the process layouts and cost model used by --pattern auto."""
+    import multiprocessing
+    import threading
+    from solution import (LocalComm, auto_layout_size, echo_messages, predict_pattern_time,
+                          profile_input)
+    
+    print("\n" + "=" * 60)
+    print("Testing automatic pattern selection layouts")
+    print("=" * 60)
+    
+    assert [auto_layout_size(1, size) for size in (1, 2, 6)] == [None, 2, 6]
+    assert [auto_layout_size(2, size) for size in (4, 5, 9)] == [None, 5, 5]
+    assert [auto_layout_size(3, size) for size in (4, 5, 8, 9, 12)] == [None, 5, 5, 9, 9]
+    
+    profile = {'lines': 10000, 'latency': 1e-5, 'transfer': 1e-7, 'lowercase': 1e-7,
+               'punctuation': 1e-6, 'stopwords': 2e-6, 'preprocess': 3e-6, 'tf': 1e-6}
+    # More workers never make the prediction worse when there are enough cores
+    assert predict_pattern_time(1, 9, profile, 16) < predict_pattern_time(1, 3, profile, 16)
+    assert predict_pattern_time(3, 9, profile, 16) < predict_pattern_time(3, 5, profile, 16)
+    # ... and do not help when all ranks share one core
+    assert predict_pattern_time(1, 9, profile, 1) >= predict_pattern_time(1, 2, profile, 1)
+    
+    # Profiling with chunk round trips on the packed transport, rank 1 echoing in a thread
+    to_rank0, from_rank1 = multiprocessing.Pipe(duplex=False)
+    to_rank1, from_rank0 = multiprocessing.Pipe(duplex=False)
+    rank0 = LocalComm(0, 2, to_rank0, {1: from_rank0}, {1: multiprocessing.Lock()})
+    rank1 = LocalComm(1, 2, to_rank1, {0: from_rank1}, {0: multiprocessing.Lock()})
+    echo = threading.Thread(target=echo_messages, args=(rank1, 'packed'))
+    echo.start()
+    sentences = ["Parallel computing, with MPI!", "Data science."] * 50 + ["Once more."]
+    measured = profile_input(rank0, sentences, {'parallel', 'data'}, {'with'}, 'packed', True)
+    echo.join()
+    assert measured['lines'] == 101 and measured['distinct_fraction'] == 3 / 101
+    assert measured['latency'] > 0 and measured['tf'] > 0
+    print("✓ Layouts and cost model behave as expected!")
+
+
+def test_local_comm_message_matching():
+    """Test that the local backend matches messages by source and tag like MPI."""
+    import multiprocessing
+    from array import array
+    from solution import LocalComm
+    
+    print("\n" + "=" * 60)
+    print("Testing local backend communicator")
+    print("=" * 60)
+    
+    # One inbound pipe per rank, shared by all sources
+    receiving_end, sending_end = multiprocessing.Pipe(duplex=False)
+    lock = multiprocessing.Lock()
+    rank0 = LocalComm(0, 3, receiving_end, {}, {})
+    rank1 = LocalComm(1, 3, None, {0: sending_end}, {0: lock})
+    rank2 = LocalComm(2, 3, None, {0: sending_end}, {0: lock})
+    assert (rank0.Get_rank(), rank0.Get_size()) == (0, 3)
+    
+    rank1.send('late tag', dest=0, tag=2)
+    rank2.send('from rank 2', dest=0, tag=1)
+    rank1.send('first', dest=0, tag=1)
+    rank1.send('second', dest=0, tag=1)
+    rank1.Send([array('q', [7, -1]), None], dest=0, tag=3)
+    
+    assert rank0.recv(source=1, tag=1) == 'first'
+    assert rank0.recv(source=1, tag=2) == 'late tag'
+    assert rank0.recv(source=1, tag=1) == 'second'
+    buffer = array('q', [0, 0])
+    rank0.Recv([buffer, None], source=1, tag=3)
+    assert list(buffer) == [7, -1]
+    assert rank0.recv(source=2, tag=1) == 'from rank 2'
+    print("✓ Messages are matched by source and tag!")
+
+
+def test_deduplicated_frequencies():
+    """Test that deduplicated processing gives the same results and counts the reuse."""
+    from solution import (SentenceCache, compile_vocabulary, compute_term_frequency,
+                          compute_document_frequency, preprocess_chunk, term_frequency_chunk,
+                          document_frequency_chunk)
+    
+    print("\n" + "=" * 60)
+    print("Testing duplicate-sentence elimination")
+    print("=" * 60)
+    
+    sentences = ["The cat sat.", "A dog ran!", "The cat sat.", "the cat sat", "The cat sat."]
+    stopwords_set = {'the', 'a'}
+    preprocess_cache = SentenceCache('preprocessing')
+    preprocessed = preprocess_chunk(sentences, stopwords_set, preprocess_cache)
+    assert preprocessed == preprocess_sentences(sentences, stopwords_set)
+    assert (preprocess_cache.reused, preprocess_cache.lookups) == (2, 5)
+    
+    for vocabulary in ({'cat', 'dog', 'sat'}, compile_vocabulary(['cat sat', 'dog'])):
+        count_cache = SentenceCache('counting')
+        for _ in range(2):  # The second chunk is served entirely from the cache
+            assert term_frequency_chunk(preprocessed, vocabulary, count_cache) == \
+                compute_term_frequency(preprocessed, vocabulary)
+            assert document_frequency_chunk(preprocessed, vocabulary, count_cache) == \
+                compute_document_frequency(preprocessed, vocabulary)
+        # 5 sentences per call, 2 distinct ones are computed once in the first call
+        assert (count_cache.reused, count_cache.lookups) == (18, 20)
+    print("✓ Deduplicated results match and reuse is counted!")
+
+
+def test_task_groups():
+    """Test the Pattern #4 task registry and the ring exchange within a group."""
+    import multiprocessing
+    import threading
+    from solution import (LocalComm, ring_exchange, sentence_length_chunk, validate_tasks,
+                          validate_process_count)
+    
+    print("\n" + "=" * 60)
+    print("Testing Pattern #4 task groups")
+    print("=" * 60)
+    
+    assert sentence_length_chunk(["a b", "c", "d e"], None) == {2: 2, 1: 1}
+    assert validate_tasks(('tf', 'df', 'lengths')) is None
+    assert validate_tasks(('tf', 'tf')) is not None
+    assert validate_tasks(()) is not None
+    assert validate_tasks(('tf', 'unknown')) is not None
+    assert validate_process_count(4, 5) is None
+    assert validate_process_count(4, 7, 3) is None
+    assert validate_process_count(4, 5, 3) is not None
+    
+    # Ring of 3 ranks (1, 2, 3), each with one inbound pipe, one thread per rank
+    group_ranks = [1, 2, 3]
+    pipes = {rank: multiprocessing.Pipe(duplex=False) for rank in group_ranks}
+    locks = {rank: multiprocessing.Lock() for rank in group_ranks}
+    gathered = {}
+    
+    def run_member(rank):
+        comm = LocalComm(rank, 4, pipes[rank][0],
+                         {dst: pipes[dst][1] for dst in group_ranks if dst != rank},
+                         {dst: locks[dst] for dst in group_ranks if dst != rank})
+        gathered[rank] = ring_exchange(comm, rank, group_ranks, [f"shard {rank}"], 'pickle')
+    
+    threads = [threading.Thread(target=run_member, args=(rank,)) for rank in group_ranks]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    for rank in group_ranks:
+        assert gathered[rank][0] == [f"shard {rank}"]
+        assert sorted(shard[0] for shard in gathered[rank]) == ["shard 1", "shard 2", "shard 3"]
+    print("✓ Every group member received the shards of the whole group!")
+
+
+def test_ngram_counting():
+    """Test n-gram counting with packed integer keys against a direct count."""
+    from collections import Counter
+    from solution import (NgramTable, decode_ngram_counts, merge_ngram_counts,
+                          ngram_counts_chunk, validate_ngrams)
+    
+    print("\n" + "=" * 60)
+    print("Testing n-gram counting")
+    print("=" * 60)
+    
+    vocabulary = {'parallel', 'computing', 'data', 'science', 'mpi'}
+    sentences = ["parallel computing data science", "data science mpi data science",
+                 "parallel x computing", "mpi"]
+    
+    for n in (1, 2, 3):
+        table = NgramTable(vocabulary, n)
+        expected_tf = Counter()
+        expected_df = Counter()
+        for sentence in sentences:
+            tokens = sentence.split()
+            grams = [' '.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)
+                     if all(token in vocabulary for token in tokens[i:i + n])]
+            expected_tf.update(grams)
+            expected_df.update(set(grams))
+        
+        # Count two halves separately and merge them like the manager does
+        tf_runs = []
+        df_runs = []
+        for half in (sentences[:2], sentences[2:]):
+            worker_tf, worker_df = ngram_counts_chunk(half, table)
+            assert list(worker_tf[0]) == sorted(worker_tf[0])
+            tf_runs.append(worker_tf)
+            df_runs.append(worker_df)
+        tf = merge_ngram_counts(tf_runs)
+        df = merge_ngram_counts(df_runs)
+        assert list(tf[0]) == sorted(set(tf[0]))
+        decoded = decode_ngram_counts(table, tf, df)
+        assert decoded['ngram_tf'] == dict(expected_tf), (n, decoded['ngram_tf'])
+        assert decoded['ngram_df'] == dict(expected_df), (n, decoded['ngram_df'])
+    
+    assert Counter(table.decode(key) for key in table.sentence_keys("data science mpi".split())) \
+        == {'data science mpi': 1}
+    assert validate_ngrams(2, vocabulary) is None
+    assert validate_ngrams(64, vocabulary) is not None
+    assert validate_ngrams(0, vocabulary) is not None
+    print("✓ Packed n-gram counts match the direct count!")
+
+
+def test_stream_reader():
+    """Test that the streaming reader follows a growing file line by line."""
+    import os
+    import tempfile
+    from solution import StreamReader
+    
+    print("\n" + "=" * 60)
+    print("Testing the streaming reader")
+    print("=" * 60)
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'stream.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("First line\n\n  Second line  \nThird li")
+        reader = StreamReader(path)
+        assert reader.read_lines(0.01, 1) == ["First line"]
+        assert reader.read_lines(0.01, 10) == ["Second line"]
+        assert reader.read_lines(0.01, 10) == []  # Incomplete line is held back
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write("ne\nFourth line\n")
+        assert reader.read_lines(0.01, 10) == ["Third line", "Fourth line"]
+        assert not reader.eof  # A file is followed, it never ends by itself
+        reader.close()
+    print("✓ Lines are read as the file grows!")
+
+
+def test_service_jobs():
+    """Test job discovery, parsing, word-list caching and a short service run."""
+    import argparse
+    import contextlib
+    import io
+    import json
+    import os
+    import shutil
+    import tempfile
+    from collections import OrderedDict
+    from solution import next_spool_job, parse_job, prepare_job, print_results, run_local
+    
+    print("\n" + "=" * 60)
+    print("Testing service mode")
+    print("=" * 60)
+    
+    text = os.path.abspath('testcases/small_text.txt')
+    vocab = os.path.abspath('testcases/small_vocab.txt')
+    stopwords = os.path.abspath('testcases/small_stopwords.txt')
+    
+    # Invalid jobs get an error message instead of raising
+    for job_text in (b'[1, 2]', b'"x"', b'not json', b'{}', b'\xff',
+                     b'{"text": "t", "vocab": 3, "stopwords": "s", "pattern": 1}',
+                     b'{"text": "t", "vocab": "v", "stopwords": "s", "pattern": "x"}',
+                     b'{"text": "t", "vocab": "v", "stopwords": "s", "pattern": 2}',
+                     b'{"text": "t", "vocab": "v", "stopwords": "s", "pattern": 1, "tasks": "tf"}',
+                     b'{"text": "t", "vocab": "v", "stopwords": "s", "pattern": 4, "tasks": []}'):
+        request, error = parse_job(job_text, 3)
+        assert request is None and error.startswith("Error"), (job_text, error)
+    assert parse_job(b'{"shutdown": true}', 3) == ({'shutdown': True}, None)
+    request, error = parse_job(json.dumps({'text': text, 'vocab': vocab, 'stopwords': stopwords,
+                                           'pattern': 4}), 3)
+    assert error is None and request['vocab'] == [vocab] and request['tasks'] == ('tf', 'df')
+    
+    with tempfile.TemporaryDirectory() as spool_dir:
+        assert next_spool_job(spool_dir) is None
+        for name in ('b.job', 'a.job.tmp', 'c.result', 'a.job'):
+            open(os.path.join(spool_dir, name), 'w').close()
+        assert next_spool_job(spool_dir) == os.path.join(spool_dir, 'a.job')
+        assert next_spool_job(spool_dir, {'a.job'}) == os.path.join(spool_dir, 'b.job')
+    
+    # Two jobs sharing the vocabulary and stopwords: the words are sent only once
+    word_set_cache = OrderedDict()
+    compiled_cache = OrderedDict()
+    worker_stopwords = set()
+    first, error = prepare_job(request, word_set_cache, compiled_cache, worker_stopwords)
+    assert error is None and first['new_vocabulary'] is not None and len(first['new_words']) == 1
+    second, error = prepare_job(request, word_set_cache, compiled_cache, worker_stopwords)
+    assert error is None and second['new_vocabulary'] is None and second['new_words'] == {}
+    
+    # A file cached by rank 0 as a vocabulary is still sent when it is first used as stopwords
+    swapped = dict(request, vocab=[stopwords], stopwords=vocab)
+    third, error = prepare_job(swapped, word_set_cache, compiled_cache, worker_stopwords)
+    assert error is None and set(third['new_words'][third['stopwords_key']]) == \
+        set(read_file_lines(vocab))
+    
+    # An edited vocabulary file replaces (evicts) the cached old version
+    with tempfile.TemporaryDirectory() as directory:
+        edited = os.path.join(directory, 'vocab.txt')
+        shutil.copy(vocab, edited)
+        edited_request = dict(request, vocab=[edited])
+        old, _ = prepare_job(edited_request, word_set_cache, compiled_cache, worker_stopwords)
+        with open(edited, 'a', encoding='utf-8') as f:
+            f.write("extra\n")
+        os.utime(edited, ns=(0, os.stat(edited).st_mtime_ns + 10 ** 9))
+        new, _ = prepare_job(edited_request, word_set_cache, compiled_cache, worker_stopwords)
+        assert old['vocab_keys'][0] in new['evicted_words']
+        assert old['vocab_keys'] in new['evicted_vocabularies']
+        assert sum(key[0] == edited for key in word_set_cache) == 1
+    
+    def expected_result(pattern, vocab_path, stopwords_path):
+        vocabulary = set(read_file_lines(vocab_path))
+        preprocessed = preprocess_sentences(read_file_lines(text),
+                                            set(read_file_lines(stopwords_path)))
+        tf = compute_term_frequency(preprocessed, vocabulary)
+        df = compute_document_frequency(preprocessed, vocabulary) if pattern == 4 else None
+        expected = io.StringIO()
+        with contextlib.redirect_stdout(expected):
+            print_results(pattern, tf, df, vocabulary)
+        return expected.getvalue()
+    
+    # End-to-end run on the local backend: two jobs sharing their files, one with
+    # the two files' roles swapped, an unreadable entry, an invalid job and a shutdown
+    with tempfile.TemporaryDirectory() as spool_dir:
+        os.mkdir(os.path.join(spool_dir, 'c2.job'))
+        jobs = {'a': {'text': text, 'vocab': vocab, 'stopwords': stopwords, 'pattern': 1},
+                'b': {'text': text, 'vocab': [vocab], 'stopwords': stopwords, 'pattern': 4},
+                'c': {'text': text, 'vocab': stopwords, 'stopwords': vocab, 'pattern': 1},
+                'd': [1, 2],
+                'e': {'shutdown': True}}
+        for name, job in jobs.items():
+            with open(os.path.join(spool_dir, name + '.job'), 'w', encoding='utf-8') as f:
+                json.dump(job, f)
+        args = argparse.Namespace(serve=spool_dir, transport='pickle', dedup=False)
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_local(args, 3)
+        
+        for name, pattern, vocab_path, stopwords_path in (('a', 1, vocab, stopwords),
+                                                          ('b', 4, vocab, stopwords),
+                                                          ('c', 1, stopwords, vocab)):
+            with open(os.path.join(spool_dir, name + '.result'), encoding='utf-8') as f:
+                assert f.read() == expected_result(pattern, vocab_path, stopwords_path), name
+        with open(os.path.join(spool_dir, 'c2.result'), encoding='utf-8') as f:
+            assert f.read().startswith("Error")
+        assert os.path.isdir(os.path.join(spool_dir, 'c2.job.failed'))
+        with open(os.path.join(spool_dir, 'd.result'), encoding='utf-8') as f:
+            assert f.read().startswith("Error")
+        with open(os.path.join(spool_dir, 'e.result'), encoding='utf-8') as f:
+            assert f.read() == "Service stopped\n"
+    print("✓ Jobs are validated, cached and processed!")
+
+
 if __name__ == '__main__':
     test_example_from_description()
     test_with_sample_files()
-
+    test_packed_chunk_operations()
+    test_batch_vocabularies()
+    test_phrase_vocabulary()
+    test_ascii_normalization()
+    test_auto_pattern_layouts()
+    test_local_comm_message_matching()
+    test_deduplicated_frequencies()
+    test_task_groups()
+    test_ngram_counting()
+    test_stream_reader()
+    test_service_jobs()